@@ -0,0 +1,150 @@
+# Streaming tar archive support for the file server.  Archives are built
+# and unpacked one 512 byte block at a time, so that whole archives never
+# have to be held in memory.
+
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+
+# Size of a tar block
+BLOCK_SIZE = 512
+
+# The two zero blocks that end a tar archive
+END_OF_ARCHIVE = bytes(2 * BLOCK_SIZE)
+
+# Tar entry types
+TYPE_FILE = b'0'
+TYPE_DIR = b'5'
+TYPE_GNU_LONGNAME = b'L'
+TYPE_PAX = b'x'
+TYPE_PAX_GLOBAL = b'g'
+
+# Whether gzip compressed archives can be streamed, which needs a zlib
+# module with incremental compression and decompression
+gzip_available = zlib is not None and hasattr(zlib, 'compressobj') \
+    and hasattr(zlib, 'decompressobj')
+
+
+# Number of padding bytes after an entry's data to fill its last block
+def padding(size: int) -> int:
+    return -size % BLOCK_SIZE
+
+# Write a value into a header field, truncated to the field length
+def put_field(header: bytearray, offset: int, length: int, value) -> None:
+    if isinstance(value, str):
+        value = value.encode()
+    value = value[:length]
+    header[offset:offset + len(value)] = value
+
+# Build the ustar header block for an entry.  Names that don't fit in the
+# name field are split into the prefix field at a '/'.
+def tar_header(name: str, size: int = 0, mtime: int = 0,
+               is_dir: bool = False) -> bytearray:
+    if is_dir:
+        name = name.rstrip('/') + '/'
+        size = 0
+    prefix = ''
+    if len(name.encode()) > 100:
+        i = name.rfind('/', 0, 156)
+        while i > 0 and len(name[i + 1:].encode()) > 100:
+            i = name.rfind('/', 0, i)
+        if i <= 0:
+            raise ValueError('name too long')
+        prefix, name = name[:i], name[i + 1:]
+    header = bytearray(BLOCK_SIZE)
+    put_field(header, 0, 100, name)
+    put_field(header, 100, 8, '0000755\0' if is_dir else '0000644\0')
+    put_field(header, 108, 8, '0000000\0')
+    put_field(header, 116, 8, '0000000\0')
+    put_field(header, 124, 12, '{:011o}\0'.format(size))
+    put_field(header, 136, 12, '{:011o}\0'.format(max(mtime, 0)))
+    put_field(header, 148, 8, b'        ')
+    put_field(header, 156, 1, TYPE_DIR if is_dir else TYPE_FILE)
+    put_field(header, 257, 8, b'ustar\x0000')
+    put_field(header, 345, 155, prefix)
+    put_field(header, 148, 8, '{:06o}\0 '.format(sum(header)))
+    return header
+
+# Parse a numeric header field
+def parse_number(field: bytes) -> int:
+    field = field.split(b'\0', 1)[0].strip()
+    return int(field, 8) if field else 0
+
+# Parse a header block into (name, type, size).  Returns None for the
+# zero block that ends an archive.
+def parse_header(header: bytes):
+    if header == END_OF_ARCHIVE[:BLOCK_SIZE]:
+        return None
+    stored = parse_number(header[148:156])
+    if sum(header[:148]) + sum(header[156:]) + 8 * 32 != stored:
+        raise ValueError('invalid tar header checksum')
+    name = header[:100].split(b'\0', 1)[0].decode()
+    if header[257:262] == b'ustar':
+        prefix = header[345:500].split(b'\0', 1)[0].decode()
+        if prefix:
+            name = prefix + '/' + name
+    type_ = header[156:157]
+    if type_ == b'\0':
+        type_ = TYPE_FILE
+    return name, type_, parse_number(header[124:136])
+
+# Get the path from the records of a pax extended header
+def parse_pax_path(data: bytes):
+    path = None
+    while data:
+        length = int(data.split(b' ', 1)[0])
+        record = data[:length]
+        data = data[length:]
+        key, value = record.split(b' ', 1)[1].split(b'=', 1)
+        if key == b'path':
+            path = value[:-1].decode()
+    return path
+
+# Compress the pieces of an archive with gzip as they are generated
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# An async stream that decompresses a gzip compressed request body as it
+# is read
+class GzipReader:
+    def __init__(self, stream, chunk_size: int = 2048):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decompressor = zlib.decompressobj(31)
+        self.pending = b''
+        self.eof = False
+
+    async def read(self, n: int = -1) -> bytes:
+        while not self.pending and not self.eof:
+            data = await self.stream.read(self.chunk_size)
+            if data:
+                self.pending = self.decompressor.decompress(data)
+            else:
+                self.pending = self.decompressor.flush()
+                self.eof = True
+        if n < 0:
+            n = len(self.pending)
+        data, self.pending = self.pending[:n], self.pending[n:]
+        return data
+
+    async def readinto(self, buf) -> int:
+        data = await self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    async def readexactly(self, n: int) -> bytes:
+        data = b''
+        while len(data) < n:
+            chunk = await self.read(n - len(data))
+            if not chunk:
+                raise EOFError('incomplete archive')
+            data += chunk
+        return data
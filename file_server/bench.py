@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# Upload and download throughput benchmark for the file server.  The app
+# is run on CPython in a subprocess, with its files in a temporary
+# directory, and exercised by concurrent clients over keep-alive
+# connections.  For every combination of file size, buffer size and
+# number of clients the throughput, p50/p99 latency and, for downloads,
+# time to first byte are reported as JSON.  The requests per second of a
+# client polling a small JSON file, like the robot arm UI polls /servo,
+# are also measured over one keep-alive connection and with a new
+# connection per request.
+#
+# Usage: python3 bench.py [options] [-o results.json]
+#
+# Downloads are sent by `Response.body_iter` from a buffer, as they are
+# on the ManT1S, unless --sendfile lets CPython use the zero copy
+# `sendfile` path instead.
+
+import argparse
+import asyncio
+import builtins
+import hashlib
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+from sync import Connection, ProtocolError
+
+
+# A stand-in for MicroPython's os module that keeps all paths inside a
+# root directory, and provides ilistdir
+def rooted_os(root: str):
+    def ilistdir(path):
+        for entry in os.scandir(root + path):
+            st = entry.stat()
+            yield (entry.name, 0x4000 if entry.is_dir() else 0x8000,
+                   st.st_ino, st.st_size)
+
+    return types.SimpleNamespace(
+        ilistdir=ilistdir,
+        listdir=lambda path: os.listdir(root + path),
+        stat=lambda path: tuple(os.stat(root + path)),
+        statvfs=lambda path: tuple(os.statvfs(root + path)),
+        mkdir=lambda path: os.mkdir(root + path),
+        remove=lambda path: os.remove(root + path),
+        rename=lambda src, dst: os.rename(root + src, root + dst),
+        urandom=os.urandom)
+
+# Run the file server app with its files in a root directory
+def serve(port: int, root: str, buffer_size: int, use_sendfile: bool):
+    import main
+    import microdot
+
+    def rooted_open(path, *args, **kwargs):
+        return builtins.open(root + path, *args, **kwargs)
+
+    main.os = microdot.os = rooted_os(root)
+    main.open = microdot.open = rooted_open
+    main.BUFFER_SIZE = main.SEND_BUFFER_SIZE = buffer_size
+    if not use_sendfile:
+        async def no_sendfile(self, stream, head=b''):
+            return False
+        microdot.Response.sendfile = no_sendfile
+    asyncio.run(main.app.start_server(host='127.0.0.1', port=port,
+                                      keep_alive=True))
+
+# Get a free TCP port on the loopback interface
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# Start a server subprocess and wait until it accepts connections
+def start_server(root: str, buffer_size: int, use_sendfile: bool):
+    port = free_port()
+    args = [sys.executable, os.path.abspath(__file__), '--serve', str(port),
+            root, str(buffer_size)]
+    if use_sendfile:
+        args.append('--sendfile')
+    proc = subprocess.Popen(args, stdout=subprocess.DEVNULL,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return proc, port
+        except OSError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise RuntimeError('file server did not start')
+            time.sleep(0.05)
+
+# Nearest rank percentile of a list of values
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+# Summary statistics of the timings of one kind of request
+def summarize(latencies: list, total_bytes: int, seconds: float) -> dict:
+    return {'mb_per_s': round(total_bytes / seconds / 1e6, 3),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3)}
+
+# One client: upload its file, then download it again, `requests` times
+async def client(port: int, path: str, data: bytes, requests: int,
+                 timings: dict) -> None:
+    conn = Connection('127.0.0.1', port)
+    digest = hashlib.sha256(data).digest()
+    try:
+        for _ in range(requests):
+            start = time.monotonic()
+            status, headers, body = await conn.request('PUT', path, data)
+            if status != 200:
+                raise ProtocolError('upload failed with status {}'.format(
+                    status))
+            timings['upload'].append(time.monotonic() - start)
+            start = time.monotonic()
+            status, headers, body = await conn.request('GET', path)
+            end = time.monotonic()
+            if status != 200 or hashlib.sha256(body).digest() != digest:
+                raise ProtocolError('download failed with status {}'.format(
+                    status))
+            timings['download'].append(end - start)
+            timings['ttfb'].append(conn.first_byte_time - start)
+    finally:
+        conn.close()
+
+# Run one benchmark case against a server
+async def run_case(port: int, size: int, clients: int,
+                   requests: int) -> dict:
+    timings = {'upload': [], 'download': [], 'ttfb': []}
+    data = [os.urandom(size) for _ in range(clients)]
+    start = time.monotonic()
+    await asyncio.gather(*(
+        client(port, '/bench/{}/{}.bin'.format(size, i), data[i], requests,
+               timings)
+        for i in range(clients)))
+    seconds = time.monotonic() - start
+    # Uploads and downloads alternate, so each gets about half the time
+    total = size * clients * requests
+    upload_time = sum(timings['upload']) / clients
+    download_time = sum(timings['download']) / clients
+    download = summarize(timings['download'], total, download_time)
+    download['ttfb_p50_ms'] = round(percentile(timings['ttfb'], 50) * 1000, 3)
+    download['ttfb_p99_ms'] = round(percentile(timings['ttfb'], 99) * 1000, 3)
+    return {'upload': summarize(timings['upload'], total, upload_time),
+            'download': download,
+            'seconds': round(seconds, 3)}
+
+# Poll a file `count` times, over one keep-alive connection or with a new
+# connection for every request, and return the requests per second
+async def poll(port: int, path: str, count: int, keep_alive: bool) -> float:
+    conn = Connection('127.0.0.1', port)
+    headers = None if keep_alive else {'Connection': 'close'}
+    try:
+        start = time.monotonic()
+        for _ in range(count):
+            status, response_headers, body = await conn.request(
+                'GET', path, headers=headers)
+            if status != 200:
+                raise ProtocolError('poll failed with status {}'.format(
+                    status))
+        return count / (time.monotonic() - start)
+    finally:
+        conn.close()
+
+# Measure polling with and without keep-alive
+def run_polling(buffer_size: int, count: int, use_sendfile: bool) -> dict:
+    root = tempfile.mkdtemp()
+    with open(os.path.join(root, 'servo.json'), 'w') as f:
+        json.dump({'shoulder_rotate': 90.0, 'shoulder_tilt': 45.0,
+                   'elbow': 120.0}, f)
+    proc, port = start_server(root, buffer_size, use_sendfile)
+    try:
+        result = {'requests': count}
+        for key, keep_alive in (('keep_alive', True), ('close', False)):
+            result[key + '_req_per_s'] = round(asyncio.run(
+                poll(port, '/servo.json', count, keep_alive)), 1)
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(root, ignore_errors=True)
+    print('polling: keep-alive {keep_alive_req_per_s:8.1f} req/s  new '
+          'connections {close_req_per_s:8.1f} req/s'.format(**result),
+          file=sys.stderr)
+    return result
+
+# Comma separated list of integers argument
+def int_list(value: str) -> list:
+    return [int(v) for v in value.split(',')]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(int(sys.argv[2]), sys.argv[3], int(sys.argv[4]),
+              '--sendfile' in sys.argv[5:])
+        return
+    parser = argparse.ArgumentParser(
+        description='Benchmark file server uploads and downloads')
+    parser.add_argument('--sizes', type=int_list,
+                        default=[1024, 64 * 1024, 1024 * 1024],
+                        help='file sizes in bytes (default 1024,65536,'
+                             '1048576)')
+    parser.add_argument('--buffer-sizes', type=int_list,
+                        default=[512, 2048, 4096],
+                        help='server upload and download buffer sizes '
+                             '(default 512,2048,4096)')
+    parser.add_argument('--clients', type=int_list, default=[1, 4],
+                        help='numbers of concurrent clients (default 1,4)')
+    parser.add_argument('--requests', type=int, default=10,
+                        help='uploads and downloads per client (default 10)')
+    parser.add_argument('--polls', type=int, default=500,
+                        help='requests of the polling benchmark, 0 to skip '
+                             'it (default 500)')
+    parser.add_argument('--sendfile', action='store_true',
+                        help='let downloads use sendfile')
+    parser.add_argument('-o', '--output', help='write the results to a file')
+    args = parser.parse_args()
+
+    results = []
+    for buffer_size in args.buffer_sizes:
+        root = tempfile.mkdtemp()
+        proc, port = start_server(root, buffer_size, args.sendfile)
+        try:
+            for clients in args.clients:
+                for size in args.sizes:
+                    result = {'size': size, 'buffer_size': buffer_size,
+                              'clients': clients, 'requests': args.requests}
+                    result.update(asyncio.run(
+                        run_case(port, size, clients, args.requests)))
+                    results.append(result)
+                    print('size {size:>8} buffer {buffer_size:>5} clients '
+                          '{clients:>2}: up {u:8.2f} MB/s  down {d:8.2f} '
+                          'MB/s'.format(u=result['upload']['mb_per_s'],
+                                        d=result['download']['mb_per_s'],
+                                        **result), file=sys.stderr)
+        finally:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {'python': platform.python_implementation() + ' ' +
+                        platform.python_version(),
+              'sendfile': args.sendfile,
+              'results': results}
+    if args.polls:
+        report['polling'] = run_polling(args.buffer_sizes[0], args.polls,
+                                        args.sendfile)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# Host side tool to deploy an app directory to a fleet of ManT1S nodes
+# running the file server.  All nodes are updated at once, each over a
+# small pool of keep-alive connections.  Only files that differ from the
+# node's manifest are uploaded (unless --full is given), failed uploads
+# are retried with exponential backoff, and every upload is verified by
+# asking the node for the digest of the stored file.
+#
+# Usage: python3 deploy.py [options] <app dir> [host[:port] ...]
+#
+# Without hosts on the command line, they are read one per line from the
+# app's hostname file.
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import ipaddress
+import os
+import sys
+import time
+
+from sync import (Connection, ProtocolError, changed_files, fetch_manifest,
+                  local_manifest, parse_host, upload_file, url_path)
+
+
+# Errors after which a request is retried
+RETRY_ERRORS = (OSError, ProtocolError, asyncio.TimeoutError,
+                asyncio.IncompleteReadError)
+
+
+# A pool of keep-alive connections to one node.  At most `size` requests
+# are in flight at once, and idle connections are reused.
+class ConnectionPool:
+    def __init__(self, host: str, port: int = 80, size: int = 2,
+                 timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle = []
+        self.semaphore = asyncio.Semaphore(size)
+
+    async def request(self, method: str, path: str, body: bytes = b'',
+                      headers: dict = None):
+        async with self.semaphore:
+            if self.idle:
+                conn = self.idle.pop()
+            else:
+                conn = Connection(self.host, self.port, self.timeout)
+            try:
+                result = await conn.request(method, path, body, headers)
+            except BaseException:
+                conn.close()
+                raise
+            self.idle.append(conn)
+            return result
+
+    def close(self) -> None:
+        for conn in self.idle:
+            conn.close()
+        self.idle = []
+
+
+# Call an async function until it succeeds, waiting twice as long after
+# each failure.  The last error is raised if all attempts fail.
+async def with_retries(fn, retries: int = 3, backoff: float = 0.5):
+    for attempt in range(retries + 1):
+        try:
+            return await fn()
+        except RETRY_ERRORS:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(backoff * 2 ** attempt)
+
+# Ask a node for the SHA-256 digest of a stored file and check that it is
+# the one that was uploaded
+async def verify_file(pool: ConnectionPool, remote_dir: str, path: str,
+                      hexdigest: str) -> None:
+    status, headers, body = await pool.request(
+        'HEAD', url_path(remote_dir, path), headers={'Want-Digest': 'sha-256'})
+    expected = 'sha-256=' + base64.b64encode(
+        bytes.fromhex(hexdigest)).decode()
+    if status != 200 or headers.get('digest') != expected:
+        raise ProtocolError('verification of {} failed: {} {}'.format(
+            path, status, headers.get('digest')))
+
+# The contents of a node's hostname file: its own name, so that deploying
+# an app to many nodes doesn't rename them all.  Nodes given by IP address
+# keep the hostname they have.
+def node_hostname(host: str):
+    try:
+        ipaddress.ip_address(host)
+        return None
+    except ValueError:
+        return host.split('.')[0] + '\n'
+
+# Deploy an app to one node.  Returns a dict of statistics, with an
+# 'error' entry if the deployment failed.
+async def deploy_node(host: str, port: int, app_dir: str, remote_dir: str,
+                      files: dict, args) -> dict:
+    start = time.monotonic()
+    stats = {'host': host if port == 80 else '{}:{}'.format(host, port),
+             'files': 0, 'bytes': 0}
+    pool = ConnectionPool(host, port, args.connections, args.timeout)
+    files = dict(files)
+    contents = {}
+    if 'hostname' in files:
+        del files['hostname']
+        hostname = node_hostname(host)
+        if hostname is not None:
+            contents['hostname'] = hostname.encode()
+            files['hostname'] = [
+                len(contents['hostname']),
+                hashlib.sha256(contents['hostname']).hexdigest()]
+    try:
+        if args.full:
+            remote = {}
+        else:
+            remote = await with_retries(
+                lambda: fetch_manifest(pool, remote_dir),
+                args.retries, args.backoff)
+
+        async def put(path):
+            async def attempt():
+                sent = await upload_file(pool, app_dir, remote_dir, path,
+                                         contents.get(path))
+                await verify_file(pool, remote_dir, path, files[path][1])
+                return sent
+            sent = await with_retries(attempt, args.retries, args.backoff)
+            stats['bytes'] += sent
+            stats['files'] += 1
+
+        await asyncio.gather(*(put(path)
+                               for path in changed_files(files, remote)))
+    except RETRY_ERRORS as exc:
+        stats['error'] = str(exc) or exc.__class__.__name__
+    finally:
+        pool.close()
+    stats['seconds'] = time.monotonic() - start
+    return stats
+
+# Read the hosts listed one per line in a file
+def read_hosts(file_name: str) -> list:
+    with open(file_name) as f:
+        return [line.strip() for line in f
+                if line.strip() and not line.startswith('#')]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Deploy an app directory to ManT1S file server nodes')
+    parser.add_argument('app_dir')
+    parser.add_argument('hosts', nargs='*', metavar='host',
+                        help="host[:port] of a node (default: the hosts in "
+                             "the app's hostname file)")
+    parser.add_argument('-f', '--hosts-file',
+                        help='file with one host per line')
+    parser.add_argument('-r', '--remote-dir', default='',
+                        help='directory on the nodes (default: the root)')
+    parser.add_argument('-c', '--connections', type=int, default=2,
+                        help='connections per node (default 2)')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='retries per request (default 3)')
+    parser.add_argument('--backoff', type=float, default=0.5,
+                        help='seconds before the first retry (default 0.5)')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='seconds to wait for a response (default 30)')
+    parser.add_argument('--full', action='store_true',
+                        help='upload all files, not only changed ones')
+    args = parser.parse_args()
+
+    hosts = list(args.hosts)
+    if args.hosts_file:
+        hosts += read_hosts(args.hosts_file)
+    if not hosts:
+        hosts = read_hosts(os.path.join(args.app_dir, 'hostname'))
+    files = local_manifest(args.app_dir)
+
+    async def deploy_all():
+        return await asyncio.gather(*(
+            deploy_node(*parse_host(host), args.app_dir, args.remote_dir,
+                        files, args)
+            for host in hosts))
+
+    start = time.monotonic()
+    results = asyncio.run(deploy_all())
+    failed = 0
+    for stats in results:
+        rate = stats['bytes'] / 1024 / max(stats['seconds'], 1e-6)
+        line = '{:24} {:3} files {:9} bytes {:7.2f} s {:8.1f} KiB/s'.format(
+            stats['host'], stats['files'], stats['bytes'], stats['seconds'],
+            rate)
+        if 'error' in stats:
+            failed += 1
+            line += '  FAILED: ' + stats['error']
+        print(line)
+    print('{} of {} nodes deployed in {:.2f} s'.format(
+        len(results) - failed, len(results), time.monotonic() - start))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
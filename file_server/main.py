@@ -1,5 +1,10 @@
 from microdot import Microdot, Request, send_file
+import archive
 import asyncio
+import binascii
+import hashlib
+import json
+import multipart
 import os
 
 # Allow large files to be sent
@@ -20,12 +25,616 @@ def mkdirp(path: str) -> None:
         pass
     try:
         os.mkdir(path)
+        invalidate_listings()
     except:
         pass
 
+# Directories with more entries than this are not cached, their listings
+# are streamed from the filesystem instead
+LISTING_CACHE_LIMIT = 100
+
+# Listings are sent in pieces of about this many characters
+LISTING_CHUNK_SIZE = 512
+
+# Cached directory listings, by directory path.  Each one holds the list
+# of (name, is_directory, size) entries and the filesystem size and free
+# space.
+listing_cache = {}
+
+# Version of the cached listings, changed whenever the filesystem is
+# written.  Together with a random ID for this boot, it makes up the
+# ETag of the listings.
+listing_version = 0
+boot_id = binascii.hexlify(os.urandom(4)).decode()
+
+
+# Drop all cached listings.  Any write changes the free space they
+# report, not only the listing of the directory written to.
+def invalidate_listings() -> None:
+    global listing_version
+    listing_cache.clear()
+    listing_version += 1
+
+# Walk the entries of a directory as (path, is_directory, size), with
+# paths relative to the directory, descending into subdirectories if
+# recursive.  Only one os.ilistdir iterator per level is held open.
+def walk(dir_name: str, recursive: bool = False, prefix: str = ''):
+    for name, ftype, inode, size in os.ilistdir(dir_name):
+        is_dir = bool(ftype & 0x4000)
+        yield prefix + name, is_dir, size
+        if recursive and is_dir:
+            yield from walk(dir_name.rstrip('/') + '/' + name, True,
+                            prefix + name + '/')
+
+# Get the cached listing of a directory, reading it if it's not cached
+# yet.  Returns None for directories too large to cache.
+def get_listing(dir_name: str):
+    listing = listing_cache.get(dir_name)
+    if listing is None:
+        entries = []
+        for entry in walk(dir_name):
+            if len(entries) == LISTING_CACHE_LIMIT:
+                return None
+            entries.append(entry)
+        bsize, frsize, blocks, free, _, _, _, _, _, _ = os.statvfs(dir_name)
+        listing = (entries, frsize * blocks, bsize * free)
+        listing_cache[dir_name] = listing
+    return listing
+
+# Generate the JSON listing in pieces, from a function that returns an
+# iterator over the entries.  Files and directories are written in two
+# passes over the entries so that they don't have to be held in memory.
+# Entries outside of the offset/limit page are skipped, and the total
+# number of entries is added when a page is requested.
+def listing_json(entries, size: int, free: int, offset: int = 0,
+                 limit: int = None):
+    out = '{'
+    total = 0
+    for key, dirs in (('files', False), ('directories', True)):
+        out += '"{}": ['.format(key)
+        sep = ''
+        total = 0
+        for path, is_dir, file_size in entries():
+            if is_dir == dirs and total >= offset and \
+                    (limit is None or total < offset + limit):
+                out += sep + json.dumps(path if dirs else (path, file_size))
+                sep = ', '
+                if len(out) >= LISTING_CHUNK_SIZE:
+                    yield out
+                    out = ''
+            total += 1
+        out += '], '
+    if offset or limit is not None:
+        out += '"total": {}, '.format(total)
+    yield out + '"size": {}, "free": {}}}'.format(size, free)
+
+# Return a directory listing, or 304 if the client's copy is current.
+# The offset and limit query arguments return a page of the entries,
+# and recursive=1 lists the whole tree with paths relative to it.
+def list_directory(req, dir_name: str):
+    etag = '"{}-{}"'.format(boot_id, listing_version)
+    if req.headers.get('If-None-Match') == etag:
+        return '', 304, {'ETag': etag}
+    headers = {'Content-Type': 'application/json; charset=UTF-8',
+               'ETag': etag}
+    offset = int(req.args.get('offset', 0))
+    limit = req.args.get('limit')
+    if limit is not None:
+        limit = int(limit)
+    recursive = req.args.get('recursive', '0') not in ('', '0')
+    listing = None if recursive else get_listing(dir_name)
+    if listing is not None:
+        # Small enough to be sent in one piece
+        entries, size, free = listing
+        return ''.join(listing_json(lambda: entries, size, free,
+                                    offset, limit)), headers
+    # Stream the listing straight from the filesystem
+    bsize, frsize, blocks, free, _, _, _, _, _, _ = os.statvfs(dir_name)
+    return listing_json(lambda: walk(dir_name, recursive),
+                        frsize * blocks, bsize * free, offset,
+                        limit), headers
+
+# Cached SHA-256 hashes of files, by file name, as (size, mtime, hex
+# digest).  Uploads store the hash they computed while streaming in.
+hash_cache = {}
+
+
+# Get the size and SHA-256 hex digest of a file, only hashing it if it
+# changed since it was last hashed
+def file_hash(file_name: str):
+    st = os.stat(file_name)
+    cached = hash_cache.get(file_name)
+    if cached is not None and cached[0] == st[6] and cached[1] == st[8]:
+        return cached[0], cached[2]
+    h = hashlib.sha256()
+    buf = get_buffer()
+    mv = memoryview(buf)
+    try:
+        with open(file_name, 'rb') as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                h.update(mv[:n])
+    finally:
+        free_buffers.append(buf)
+    digest = binascii.hexlify(h.digest()).decode()
+    hash_cache[file_name] = (st[6], st[8], digest)
+    return st[6], digest
+
+# Generate the manifest of a directory tree in pieces: a JSON object that
+# maps the path of each file, relative to the directory, to its size and
+# SHA-256 hex digest
+def manifest_json(dir_name: str):
+    base = dir_name.rstrip('/') + '/'
+    out = '{'
+    sep = ''
+    for path, is_dir, size in walk(dir_name, True):
+        if is_dir:
+            continue
+        size, digest = file_hash(base + path)
+        out += '{}{}: [{}, "{}"]'.format(sep, json.dumps(path), size, digest)
+        sep = ', '
+        if len(out) >= LISTING_CHUNK_SIZE:
+            yield out
+            out = ''
+    yield out + '}'
+
+# Size of the buffers uploads are read into
+BUFFER_SIZE = 2048
+
+# Size of the buffer files are sent from
+SEND_BUFFER_SIZE = 4096
+
+# Counter used to give each upload its own temporary file
+upload_count = 0
+
+# Marker in the names of the temporary files of uploads, which are named
+# '<file>.~upload-<boot ID>-<N>'
+TEMP_MARKER = '.~upload-'
+
+# Upload buffers that are free to be reused, so that uploads don't
+# allocate memory for every chunk they receive
+free_buffers = []
+
+# Hash constructors for the digest algorithms uploads can be checked with
+digest_algorithms = {'sha-256': hashlib.sha256}
+if hasattr(hashlib, 'md5'):
+    digest_algorithms['md5'] = hashlib.md5
+
+
+# Base64 encode a digest, as used in Digest and Content-MD5 headers
+def b64(digest: bytes) -> str:
+    return binascii.b2a_base64(digest).decode().strip()
+
+# Get the expected digests of an upload from its Digest and Content-MD5
+# headers, as a dict of algorithm name to base64 digest
+def expected_digests(req) -> dict:
+    expected = {}
+    for item in req.headers.get('Digest', '').split(','):
+        if '=' in item:
+            algorithm, value = item.strip().split('=', 1)
+            expected[algorithm.lower()] = value
+    if 'Content-MD5' in req.headers:
+        expected['md5'] = req.headers['Content-MD5'].strip()
+    return expected
+
+# Get a buffer to read an upload into
+def get_buffer() -> bytearray:
+    if free_buffers:
+        return free_buffers.pop()
+    return bytearray(BUFFER_SIZE)
+
+# Read a stream into a file through a reused buffer, updating the given
+# hashes, until the end of the stream or the given number of bytes.
+# Returns the number of bytes written.
+async def stream_to_file(stream, f, hashes=(), limit=None) -> int:
+    buf = get_buffer()
+    mv = memoryview(buf)
+    length = 0
+    try:
+        while limit is None or length < limit:
+            if limit is not None and limit - length < len(buf):
+                n = await stream.readinto(mv[:limit - length])
+            else:
+                n = await stream.readinto(buf)
+            if not n:
+                break
+            f.write(mv[:n])
+            for h in hashes:
+                h.update(mv[:n])
+            length += n
+    finally:
+        free_buffers.append(buf)
+    return length
+
+# Name of a new temporary file for an upload to a file
+def temp_file_name(file_name: str) -> str:
+    global upload_count
+    upload_count += 1
+    return '{}{}{}-{}'.format(file_name, TEMP_MARKER, boot_id, upload_count)
+
+# Whether a file is the temporary file of an upload, as named by
+# temp_file_name() in this or an earlier boot
+def is_temp_file(name: str) -> bool:
+    head, sep, suffix = name.rpartition(TEMP_MARKER)
+    boot, sep2, count = suffix.partition('-')
+    return bool(sep) and head.rsplit('/', 1)[-1] != '' and \
+        len(boot) == 8 and all(c in '0123456789abcdef' for c in boot) and \
+        bool(sep2) and count.isdigit()
+
+# Remove the temporary files left behind by uploads that were cut short
+# by a crash or reset, which would otherwise show up in listings,
+# manifests and archives.  Returns the number of files removed.
+def remove_temp_files(dir_name: str = '/') -> int:
+    base = dir_name.rstrip('/') + '/'
+    stale = [path for path, is_dir, size in walk(dir_name, True)
+             if not is_dir and is_temp_file(path)]
+    for path in stale:
+        try:
+            os.remove(base + path)
+        except:
+            pass
+    if stale:
+        invalidate_listings()
+    return len(stale)
+
+# Move a file into place, replacing the old one
+def replace_file(src: str, dst: str) -> None:
+    try:
+        os.rename(src, dst)
+    except:
+        # Some filesystems can't rename over an existing file
+        os.remove(dst)
+        os.rename(src, dst)
+
+# Partial uploads in progress, by file name.  Each one records the total
+# size of the file and the sorted, merged list of [start, end) byte ranges
+# written so far to the file name with a '.part' suffix.
+partial_uploads = {}
+
+
+# Parse a 'bytes first-last/total' Content-Range header
+def parse_content_range(value: str):
+    unit, spec = value.strip().split(' ', 1)
+    if unit != 'bytes':
+        raise ValueError('invalid unit')
+    span, total = spec.split('/', 1)
+    first, last = span.split('-', 1)
+    first, last, total = int(first), int(last), int(total)
+    if first > last or last >= total:
+        raise ValueError('invalid range')
+    return first, last, total
+
+# Add a written [start, end) range to the list of written ranges
+def add_range(ranges: list, start: int, end: int) -> None:
+    ranges.append([start, end])
+    ranges.sort()
+    merged = [ranges[0]]
+    for r in ranges[1:]:
+        if r[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], r[1])
+        else:
+            merged.append(r)
+    ranges[:] = merged
+
+# Number of bytes of a partial upload that are written contiguously from
+# the start of the file, which is where a sequential upload can resume
+def committed_size(upload) -> int:
+    ranges = upload[1]
+    return ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+
+# Get the partial upload for a file, picking up a '.part' file left by
+# an upload interrupted by a reset
+def get_partial_upload(file_name: str):
+    upload = partial_uploads.get(file_name)
+    if upload is None:
+        try:
+            size = os.stat(file_name + '.part')[6]
+        except:
+            return None
+        # Only the size is known, assume it was written sequentially
+        upload = [None, [[0, size]] if size else []]
+        partial_uploads[file_name] = upload
+    return upload
+
+# Forget an unfinished partial upload of a file and remove its '.part'
+# file, when a complete upload replaces it
+def drop_partial_upload(file_name: str) -> None:
+    partial_uploads.pop(file_name, None)
+    try:
+        os.remove(file_name + '.part')
+        invalidate_listings()
+    except:
+        pass
+
+# Free space in bytes on the filesystem a file would be saved to
+def free_space(file_name: str) -> int:
+    dir_name = file_name.rsplit('/', 1)[0] or '/'
+    while True:
+        try:
+            bsize, _, _, free, _, _, _, _, _, _ = os.statvfs(dir_name)
+            return bsize * free
+        except:
+            if dir_name == '/':
+                return 0
+            # The directory isn't made yet, check its parent
+            dir_name = dir_name.rsplit('/', 1)[0] or '/'
+
+# Write one piece of a file sent with a Content-Range header, and move
+# the file into place once all of its pieces have been received
+async def put_range(req, file_name: str):
+    try:
+        first, last, total = parse_content_range(req.headers['Content-Range'])
+    except:
+        return "Invalid Content-Range", 400
+    part_name = file_name + '.part'
+    # Check the size of the whole file before the '.part' file is made
+    # or grown to it
+    try:
+        needed = total - os.stat(part_name)[6]
+    except:
+        needed = total
+    if total > Request.max_content_length or needed > free_space(file_name):
+        return "Payload too large", 413
+    upload = get_partial_upload(file_name)
+    if upload is not None and upload[0] not in (None, total):
+        # A different upload to the same file was left unfinished
+        partial_uploads.pop(file_name)
+        upload = None
+    if upload is None:
+        # Start a new partial upload, creating the '.part' file before
+        # anything is awaited so pieces sent in parallel don't race
+        mkdirp(file_name.rsplit('/', 1)[0])
+        open(part_name, 'wb').close()
+        upload = [total, []]
+        partial_uploads[file_name] = upload
+    upload[0] = total
+    try:
+        f = open(part_name, 'r+b')
+    except:
+        return "Data save error", 503
+    try:
+        f.seek(first)
+        await stream_to_file(req.stream, f, limit=last - first + 1)
+    except:
+        return "Data save error", 503
+    finally:
+        # Record what was written, even if the link dropped part way
+        length = f.tell() - first
+        f.close()
+        if length > 0:
+            add_range(upload[1], first, first + length)
+        invalidate_listings()
+    headers = {'Upload-Offset': str(committed_size(upload))}
+    if length != last - first + 1:
+        return "Incomplete range", 400, headers
+    if upload[1] != [[0, total]]:
+        return "Range upload successful", 200, headers
+    # All pieces are in, replace the file
+    partial_uploads.pop(file_name, None)
+    hash_cache.pop(file_name, None)
+    try:
+        replace_file(part_name, file_name)
+    except:
+        return "Data save error", 503, headers
+    finally:
+        invalidate_listings()
+    return "File upload successful", 200, headers
+
+# Write a complete file to a temporary file, hashing it as it streams in,
+# and only move it into place if it arrived intact
+async def put_file(req, file_name: str):
+    expected = expected_digests(req)
+    for algorithm in expected:
+        if algorithm not in digest_algorithms:
+            return "Unsupported digest algorithm", 400
+    hashes = {'sha-256': hashlib.sha256()}
+    for algorithm in expected:
+        if algorithm not in hashes:
+            hashes[algorithm] = digest_algorithms[algorithm]()
+    temp_name = temp_file_name(file_name)
+    try:
+        # Ensure the directory for the file exists
+        mkdirp(file_name.rsplit('/', 1)[0])
+        # Open the temporary file for writing
+        with open(temp_name, 'wb') as f:
+            # Write streamed chunks until the end of the body, which
+            # also works for chunked uploads of unknown length
+            await stream_to_file(req.stream, f, hashes.values())
+        raw_digests = {a: h.digest() for a, h in hashes.items()}
+        digests = {a: b64(d) for a, d in raw_digests.items()}
+        headers = {'Digest': 'sha-256=' + digests['sha-256']}
+        for algorithm, value in expected.items():
+            if digests[algorithm] != value:
+                os.remove(temp_name)
+                return "Digest mismatch", 400, headers
+        replace_file(temp_name, file_name)
+        # The hash of the new file is already known
+        st = os.stat(file_name)
+        hash_cache[file_name] = (
+            st[6], st[8],
+            binascii.hexlify(raw_digests['sha-256']).decode())
+    except:
+        try:
+            os.remove(temp_name)
+        except:
+            pass
+        return "Data save error", 503
+    finally:
+        invalidate_listings()
+    return "File upload successful", 200, headers
+
+# Generate a tar archive of a directory tree, one block at a time
+def tar_directory(dir_name: str):
+    base = dir_name.rstrip('/') + '/'
+    buf = get_buffer()
+    mv = memoryview(buf)
+    try:
+        for path, is_dir, size in walk(dir_name, True):
+            mtime = os.stat(base + path)[8]
+            yield archive.tar_header(path, size, mtime, is_dir)
+            if is_dir:
+                continue
+            # Send exactly the size given in the header
+            remaining = size
+            with open(base + path, 'rb') as f:
+                while remaining:
+                    n = f.readinto(mv[:min(remaining, len(buf))])
+                    if not n:
+                        break
+                    remaining -= n
+                    yield mv[:n]
+            pad = remaining + archive.padding(size)
+            if pad:
+                yield bytes(pad)
+        yield archive.END_OF_ARCHIVE
+    finally:
+        free_buffers.append(buf)
+
+# Send a directory tree as a tar archive, gzip compressed if requested
+def send_archive(dir_name: str, kind: str):
+    name = dir_name.rstrip('/').rsplit('/', 1)[-1] or 'root'
+    if kind == 'tar':
+        return tar_directory(dir_name), {
+            'Content-Type': 'application/x-tar',
+            'Content-Disposition': 'attachment; filename="{}.tar"'.format(
+                name)}
+    if kind == 'tar.gz' and archive.gzip_available:
+        return archive.gzip_chunks(tar_directory(dir_name)), {
+            'Content-Type': 'application/gzip',
+            'Content-Disposition':
+                'attachment; filename="{}.tar.gz"'.format(name)}
+    return "Unsupported archive type", 400
+
+# Unpack a tar archive sent in a PUT request into a directory tree, as it
+# streams in.  Each file is written to a temporary file and moved into
+# place once complete.  Archives sent with Content-Encoding: gzip are
+# decompressed on the way.
+async def extract_archive(req, dir_name: str):
+    stream = req.stream
+    if req.headers.get('Content-Encoding', '').lower() == 'gzip':
+        if not archive.gzip_available:
+            return "Compressed archives not supported", 415
+        stream = archive.GzipReader(stream)
+    base = dir_name.rstrip('/') + '/'
+    files = 0
+    length = 0
+    long_name = None
+    try:
+        while True:
+            entry = archive.parse_header(
+                await stream.readexactly(archive.BLOCK_SIZE))
+            if entry is None:
+                break
+            name, type_, size = entry
+            if type_ in (archive.TYPE_GNU_LONGNAME, archive.TYPE_PAX):
+                # The name of the next entry, or other metadata for it
+                data = await stream.readexactly(size + archive.padding(size))
+                if type_ == archive.TYPE_GNU_LONGNAME:
+                    long_name = data[:size].split(b'\0', 1)[0].decode()
+                else:
+                    long_name = archive.parse_pax_path(data[:size])
+                continue
+            if long_name:
+                name, long_name = long_name, None
+            while name.startswith('./'):
+                name = name[2:]
+            name = name.strip('/')
+            if '..' in name.split('/'):
+                return "Directory traversal not allowed", 403
+            # Skip the data of other entry types, and the padding
+            skip = size + archive.padding(size)
+            if type_ == archive.TYPE_DIR:
+                if name:
+                    mkdirp(base + name)
+            elif type_ == archive.TYPE_FILE and name:
+                file_name = base + name
+                mkdirp(file_name.rsplit('/', 1)[0])
+                temp_name = temp_file_name(file_name)
+                with open(temp_name, 'wb') as f:
+                    written = await stream_to_file(stream, f, limit=size)
+                if written != size:
+                    os.remove(temp_name)
+                    raise EOFError('incomplete archive')
+                hash_cache.pop(file_name, None)
+                replace_file(temp_name, file_name)
+                files += 1
+                length += size
+                skip = archive.padding(size)
+            while skip:
+                skip -= len(await stream.readexactly(
+                    min(skip, archive.BLOCK_SIZE)))
+        # Read the second end of archive block and the record padding, so
+        # that the connection can be kept open
+        while await req.stream.read(BUFFER_SIZE):
+            pass
+    except ValueError:
+        return "Invalid archive", 400
+    except:
+        return "Data save error", 503
+    finally:
+        invalidate_listings()
+    return {'files': files, 'bytes': length}
+
+# Save the files of a multipart/form-data upload from a browser form into
+# a directory, as they stream in.  Each file is written to a temporary
+# file and moved into place once complete.  Fields that aren't files are
+# ignored.
+async def post_form(req, dir_name: str):
+    boundary = multipart.form_data_boundary(req.content_type)
+    if boundary is None:
+        return "Expected multipart/form-data", 415
+    reader = multipart.MultipartReader(req.stream, boundary, BUFFER_SIZE)
+    base = dir_name.rstrip('/') + '/'
+    files = 0
+    length = 0
+    temp_name = None
+    try:
+        while True:
+            headers = await reader.next_part()
+            if headers is None:
+                break
+            disposition, options = multipart.parse_header_options(
+                headers.get('Content-Disposition', ''))
+            # Only the name of the file is used, some browsers send the
+            # whole path
+            name = options.get('filename', '').replace('\\', '/')
+            name = name.rsplit('/', 1)[-1]
+            if disposition != 'form-data' or name in ('', '.', '..'):
+                continue
+            file_name = base + name
+            mkdirp(dir_name)
+            temp_name = temp_file_name(file_name)
+            sha256 = hashlib.sha256()
+            with open(temp_name, 'wb') as f:
+                size = await stream_to_file(reader, f, (sha256,))
+            replace_file(temp_name, file_name)
+            temp_name = None
+            drop_partial_upload(file_name)
+            st = os.stat(file_name)
+            hash_cache[file_name] = (
+                st[6], st[8], binascii.hexlify(sha256.digest()).decode())
+            files += 1
+            length += size
+    except ValueError:
+        return "Invalid form data", 400
+    except:
+        return "Data save error", 503
+    finally:
+        if temp_name is not None:
+            try:
+                os.remove(temp_name)
+            except:
+                pass
+        invalidate_listings()
+    return {'files': files, 'bytes': length}
+
 @app.get('')
 @app.get('/')
-@app.route('/<path:path>', ['GET', 'PUT'])
+@app.post('')
+@app.post('/')
+@app.route('/<path:path>', ['GET', 'PUT', 'POST'])
 async def update_file_handler(req, path=None):
     # Directory traversal is not allowed
     if path is not None and '..' in path:
@@ -34,55 +643,55 @@ async def update_file_handler(req, path=None):
     file_name = req.path
     if req.method == 'PUT':
         # PUT: An update file is sent
-        try:
-            # Ensure the directory for the file exists
-            mkdirp(file_name.rsplit('/', 1)[0])
-            # Open the file for writing
-            with open(file_name, 'wb') as f:
-                # Write streamed chunks until full length received
-                length = 0
-                while length < req.content_length:
-                    chunk = await req.stream.read(2048)
-                    f.write(chunk)
-                    length += len(chunk)
-            return "File upload successful"
-        except:
-            return "Data save error", 503
+        if req.content_type and \
+                req.content_type.split(';')[0] == 'application/x-tar':
+            # An archive of files to unpack into this directory
+            return await extract_archive(req, file_name)
+        if 'Content-Range' in req.headers:
+            # One piece of a resumable or parallel upload
+            return await put_range(req, file_name)
+        # A complete file replaces any unfinished partial upload
+        drop_partial_upload(file_name)
+        return await put_file(req, file_name)
+    elif req.method == 'POST':
+        # POST: files uploaded from a browser form into this directory
+        return await post_form(req, file_name)
     else:
+        if req.method == 'HEAD':
+            # HEAD: report how much of a partial upload has been received
+            upload = get_partial_upload(file_name)
+            if upload is not None:
+                headers = {'Upload-Offset': str(committed_size(upload))}
+                if upload[0] is not None:
+                    headers['Upload-Length'] = str(upload[0])
+                return '', 200, headers
         # GET: send the requested file
         # Make sure it exists
         try:
             # Is it a directory?
-            if os.stat(file_name)[0] & 0x4000:
-                # Init return object
-                ret = {
-                    'files': [],
-                    'directories': []
-                }
-                # Get directory listing
-                for name, ftype, inode, size in list(os.ilistdir(file_name)):
-                    # Is it a directory?
-                    if ftype & 0x4000:
-                        # Add to directories
-                        ret['directories'].append(name)
-                    else:
-                        # Add to files
-                        ret['files'].append((name, size))
-                # Append filesystem size info
-                bsize, frsize, blocks, free, _, _, _, _, _, _ = \
-                                                    os.statvfs(file_name)
-                ret['size'] = frsize * blocks
-                ret['free'] = bsize * free
-                # Return the listing
-                return ret
+            if file_name in listing_cache or os.stat(file_name)[0] & 0x4000:
+                if 'archive' in req.args:
+                    return send_archive(file_name, req.args['archive'])
+                if 'manifest' in req.args:
+                    return manifest_json(file_name), {
+                        'Content-Type': 'application/json; charset=UTF-8'}
+                return list_directory(req, file_name)
             else:
                 # Send the file
-                return send_file(file_name)
+                res = send_file(file_name, buffer_size=SEND_BUFFER_SIZE,
+                                accept_ranges=True)
+                # With its digest if the client asked for it
+                if 'sha-256' in req.headers.get('Want-Digest', '').lower():
+                    res.headers['Digest'] = 'sha-256=' + b64(
+                        binascii.unhexlify(file_hash(file_name)[1]))
+                return res
         except:
             # Doesn't exist
             return "File not found", 404
 
 # Guard to allow import as module
 if __name__ == "__main__":
-    asyncio.run(app.start_server(port=80))
+    # No uploads are in progress yet, so any temporary files are stale
+    remove_temp_files()
+    asyncio.run(app.start_server(port=80, keep_alive=True))
 
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# Micro-benchmarks of the request and response handling code in
+# microdot.py, run on CPython.  Each case is timed on its own and the
+# best time per call is reported, as JSON with -o.  With --check, the
+# checks of the number of writes and allocations are run instead.
+#
+# Usage: python3 microbench.py [-n NUMBER] [-o results.json] [case ...]
+#        python3 microbench.py --check [check ...]
+
+import argparse
+import io
+import json
+import sys
+import timeit
+import tracemalloc
+
+from microdot import (AsyncBytesIO, JSONArrayReader, Microdot, NoCaseDict,
+                      Request, Response, urldecode, urlencode)
+
+
+# Headers of a request from a browser
+BROWSER_HEADERS = {
+    'Host': 'mant1s-robotarm',
+    'Connection': 'keep-alive',
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+                  '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,'
+              '*/*;q=0.8',
+    'Accept-Encoding': 'gzip, deflate',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Content-Type': 'application/json',
+    'Content-Length': '13',
+    'Cookie': 'session=abc123; theme=dark',
+}
+
+# A long form body, as sent by a browser
+FORM_BODY = ('name=ManT1S+robot+arm&notes=' + 'Moved+to+50%25+%26+back%2C+'
+             'speed%3D3+%E2%86%92+ok%21+' * 100).encode()
+FORM_TEXT = 'Moved to 50% & back, speed=3 -> ok? #' * 100
+
+# A JSON body of servo positions, and a batch of them as a JSON array
+JSON_BODY = json.dumps({'shoulder_rotate': 90.5, 'shoulder_tilt': 45,
+                        'elbow': 120, 'note': 'é' * 2000}).encode()
+JSON_BATCH = json.dumps([{'t': i * 0.025, 'shoulder_rotate': 90.5,
+                          'shoulder_tilt': 45, 'elbow': 120}
+                         for i in range(100)]).encode()
+JSON_HEADERS = NoCaseDict({'Content-Type': 'application/json',
+                           'Content-Length': str(len(JSON_BODY))})
+
+# The head of a control request, and the same request with a query string
+# and cookies that its handler doesn't use
+CURL_FIELDS = (b'Host: mant1s-robotarm\r\nUser-Agent: curl/8.5.0\r\n'
+               b'Accept: */*\r\n')
+CONTROL_HEAD = b'GET /on HTTP/1.1\r\n' + CURL_FIELDS + b'\r\n'
+QUERY_COOKIE_HEAD = (b'GET /on?offset=10&limit=5 HTTP/1.1\r\n' + CURL_FIELDS +
+                     b'Cookie: session=abc123; theme=dark\r\n\r\n')
+
+# Raw request heads as sent by browsers and curl to the demos
+HEAD_CORPUS = [
+    # a browser loading a page it has cached
+    b'GET / HTTP/1.1\r\nHost: mant1s-robotarm\r\nConnection: keep-alive\r\n'
+    b'Upgrade-Insecure-Requests: 1\r\nUser-Agent: Mozilla/5.0 (X11; Linux '
+    b'x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 '
+    b'Safari/537.36\r\nAccept: text/html,application/xhtml+xml,'
+    b'application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8\r\n'
+    b'Accept-Encoding: gzip, deflate\r\nAccept-Language: en-US,en;q=0.9\r\n'
+    b'Cookie: session=abc123; theme=dark\r\n'
+    b'If-None-Match: "6ad4bb9d-14bb"\r\n'
+    b'If-Modified-Since: Sun, 18 Oct 2026 12:29:01 GMT\r\n\r\n',
+    # a browser loading a stylesheet of the page
+    b'GET /pico.indigo.min.css HTTP/1.1\r\nHost: mant1s-robotarm\r\n'
+    b'Connection: keep-alive\r\nUser-Agent: Mozilla/5.0 (X11; Linux x86_64; '
+    b'rv:121.0) Gecko/20100101 Firefox/121.0\r\nAccept: text/css,*/*;q=0.1'
+    b'\r\nAccept-Encoding: gzip, deflate\r\nAccept-Language: en-US,en;q=0.5'
+    b'\r\nReferer: http://mant1s-robotarm/\r\n\r\n',
+    # a page script moving a servo
+    b'POST /servo HTTP/1.1\r\nHost: mant1s-robotarm\r\nConnection: keep-alive'
+    b'\r\nContent-Length: 13\r\nUser-Agent: Mozilla/5.0 (X11; Linux x86_64) '
+    b'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+    b'\r\nContent-Type: application/json\r\nAccept: */*\r\n'
+    b'Origin: http://mant1s-robotarm\r\nReferer: http://mant1s-robotarm/\r\n'
+    b'Accept-Encoding: gzip, deflate\r\nAccept-Language: en-US,en;q=0.9\r\n'
+    b'\r\n{"elbow": 30}',
+    # curl uploading and listing files
+    b'PUT /logs/run1.csv HTTP/1.1\r\nHost: mant1s-file\r\n'
+    b'User-Agent: curl/8.5.0\r\nAccept: */*\r\nContent-Length: 5\r\n\r\n'
+    b'hello',
+    b'GET /logs/?offset=10&limit=5 HTTP/1.1\r\nHost: mant1s-file\r\n'
+    b'User-Agent: curl/8.5.0\r\nAccept: */*\r\n\r\n',
+    # curl switching the light on with HTTP/1.0
+    b'GET /on HTTP/1.0\r\nHost: mant1s-light\r\nUser-Agent: curl/8.5.0\r\n'
+    b'Accept: */*\r\n\r\n',
+]
+
+# The benchmark cases, by name
+cases = {}
+
+# The checks, by name
+checks = {}
+
+
+# Register a function as a benchmark case
+def case(f):
+    cases[f.__name__] = f
+    return f
+
+
+# Register a function as a check, which raises AssertionError on failure
+def check(f):
+    checks[f.__name__] = f
+    return f
+
+
+# Run a coroutine that never waits, such as one that only reads from
+# AsyncBytesIO, and return its result
+def run(coro):
+    try:
+        coro.send(None)
+    except StopIteration as exc:
+        return exc.value
+    raise RuntimeError('coroutine did not finish in one step')
+
+
+# A stream with no readuntil(), that is read line by line like a
+# MicroPython stream
+class LineStream:
+    def __init__(self, data: bytes):
+        self.stream = io.BytesIO(data)
+
+    async def readline(self):
+        return self.stream.readline()
+
+    async def read(self, n=-1):
+        return self.stream.read(n)
+
+    async def readexactly(self, n):
+        return self.stream.read(n)
+
+
+# Build a request from a raw head, read line by line
+def create_request(head: bytes) -> Request:
+    return run(Request.create(None, LineStream(head), None,
+                              ('127.0.0.1', 0)))
+
+
+# A stream that keeps the data of each write made to it
+class CountingStream:
+    def __init__(self):
+        self.writes = []
+
+    async def awrite(self, data):
+        self.writes.append(bytes(data))
+
+
+@case
+def headers_build():
+    NoCaseDict(BROWSER_HEADERS)
+
+
+request_headers = NoCaseDict(BROWSER_HEADERS)
+
+
+@case
+def headers_request_lookups():
+    # the lookups done in Request.__init__
+    h = request_headers
+    h.get('Content-Length')
+    h.get('Content-Type')
+    h.get('Cookie')
+
+
+@case
+def headers_other_case_lookups():
+    h = request_headers
+    h.get('content-length')
+    h.get('CONTENT-TYPE')
+    h.get('cookie')
+
+
+@case
+def headers_missing():
+    h = request_headers
+    'Range' in h
+    'If-None-Match' in h
+    h.get('Transfer-Encoding')
+
+
+@case
+def headers_response():
+    h = NoCaseDict({'Content-Type': 'application/json; charset=UTF-8'})
+    h['Content-Length'] = '42'
+    'Content-Length' in h
+    'Transfer-Encoding' in h
+    'Content-Type' in h
+    for header, value in h.items():
+        pass
+
+
+@case
+def request_minimal():
+    # a control request like the robot arm's, that uses no args or cookies
+    Request(None, ('127.0.0.1', 0), 'GET', '/on', 'HTTP/1.1',
+            NoCaseDict(BROWSER_HEADERS))
+
+
+@case
+def request_query_cookies():
+    req = Request(None, ('127.0.0.1', 0), 'GET', '/list?offset=10&limit=5',
+                  'HTTP/1.1', NoCaseDict(BROWSER_HEADERS))
+    req.args.get('offset')
+    req.cookies.get('session')
+
+
+@case
+def request_create_corpus():
+    # every head of the corpus, read in one readuntil() call
+    for head in HEAD_CORPUS:
+        run(Request.create(None, AsyncBytesIO(head), None,
+                           ('127.0.0.1', 0)))
+
+
+@case
+def request_create_corpus_lines():
+    # every head of the corpus, read line by line as on MicroPython
+    for head in HEAD_CORPUS:
+        create_request(head)
+
+
+@case
+def urldecode_form():
+    urldecode(FORM_BODY)
+
+
+@case
+def urldecode_plain():
+    urldecode('offset=10')
+
+
+@case
+def urlencode_text():
+    urlencode(FORM_TEXT)
+
+
+@case
+def request_json():
+    Request(None, ('127.0.0.1', 0), 'POST', '/servo', 'HTTP/1.1',
+            JSON_HEADERS, body=JSON_BODY).json
+
+
+async def read_batch():
+    async for point in JSONArrayReader(AsyncBytesIO(JSON_BATCH)):
+        pass
+
+
+@case
+def json_items_batch():
+    # a batch of 100 servo positions, decoded one at a time.  Reads from
+    # AsyncBytesIO never wait, so the coroutine finishes in one step.
+    run(read_batch())
+
+
+# An app with n routes, a third of them static, a third with an int
+# argument and the rest with a path argument
+def routing_app(n: int) -> Microdot:
+    app = Microdot()
+
+    def handler(req, **kwargs):
+        pass
+
+    for i in range(n):
+        if i % 3 == 0:
+            app.get('/static{}'.format(i))(handler)
+        elif i % 3 == 1:
+            app.get('/item{}/<int:id>'.format(i))(handler)
+        else:
+            app.get('/files{}/<path:path>'.format(i))(handler)
+    return app
+
+# The paths looked up in an app with n routes.  The hits are on the last
+# route of each kind, the worst case for a scan of the URL map.
+def routing_paths(n: int) -> dict:
+    last = n - 1
+    return {'static': '/static{}'.format(last - last % 3),
+            'int': '/item{}/42'.format(last - (last - 1) % 3),
+            'path': '/files{}/a/b/c.txt'.format(last - (last - 2) % 3),
+            'miss': '/nothing/here'}
+
+# Find the route of a request by matching every URL pattern in turn, as
+# Microdot did before it indexed its routes
+def scan_route(app: Microdot, req: Request):
+    for methods, pattern, handler, url_prefix, subapp in app.url_map:
+        req.url_args = pattern.match(req.path)
+        if req.url_args is not None and req.method in methods:
+            return handler
+    return 404
+
+# Register the routing cases for an app with n routes, each with a _scan
+# twin that finds the route the old way
+def routing_cases(n: int) -> None:
+    app = routing_app(n)
+    for kind, path in routing_paths(n).items():
+        req = Request(app, ('127.0.0.1', 0), 'GET', path, 'HTTP/1.1',
+                      NoCaseDict())
+        name = 'route_{}_{}'.format(kind, n)
+        cases[name] = lambda req=req: app.find_route(req)
+        cases[name + '_scan'] = lambda req=req: scan_route(app, req)
+
+
+for _n in (10, 100, 1000):
+    routing_cases(_n)
+
+
+# A streamed body made of the given pieces
+def pieces(*data):
+    for piece in data:
+        yield piece
+
+
+# The writes made to send a response
+def response_writes(res: Response) -> list:
+    stream = CountingStream()
+    run(res.write(stream))
+    return stream.writes
+
+
+# Blocks and bytes still allocated per call after calling f n times and
+# keeping the results
+def allocations(f, n: int = 200):
+    f()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        results = [f() for _ in range(n)]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(ignore).compare_to(
+        before.filter_traces(ignore), 'filename')
+    del results
+    return (sum(stat.count_diff for stat in stats) / n,
+            sum(stat.size_diff for stat in stats) / n)
+
+
+# Print the allocations of a check
+def print_allocations(name: str, blocks: float, size: float) -> None:
+    print('  {:30} {:5.1f} blocks {:7.1f} bytes'.format(name, blocks, size),
+          file=sys.stderr)
+
+
+@check
+def request_allocations():
+    # a request with cookies that aren't used only allocates the request
+    # object and its attributes, not the args, cookies and g
+    blocks, size = allocations(lambda: Request(
+        None, ('127.0.0.1', 0), 'GET', '/on', 'HTTP/1.1', request_headers))
+    print_allocations('Request()', blocks, size)
+    assert round(blocks) <= 2, blocks
+    # a query string and cookies that aren't used only cost the strings
+    # they're read into, parsing them would take about 15 more blocks
+    plain, size = allocations(lambda: create_request(CONTROL_HEAD))
+    print_allocations('Request.create()', plain, size)
+    blocks, size = allocations(lambda: create_request(QUERY_COOKIE_HEAD))
+    print_allocations('with query and cookies', blocks, size)
+    assert blocks - plain < 8, (plain, blocks)
+
+
+@check
+def writes_small_response():
+    # the status line, headers and a small body go out in one write
+    for body in ({'shoulder_rotate': 90.5}, 'ok', b'x' * 1024, '', None):
+        writes = response_writes(Response(body))
+        assert len(writes) == 1, (body, writes)
+    writes = response_writes(Response(pieces(b'on', b'off')))
+    assert len(writes) == 2 and writes[0].endswith(b'\r\n\r\non'), writes
+
+
+@check
+def writes_streamed_body():
+    # a streamed body with large pieces gets the head in one write of its
+    # own, followed by one write per piece
+    piece = b'x' * (Response.coalesce_body_size + 1)
+    writes = response_writes(Response(pieces(piece, piece, piece)))
+    assert len(writes) == 4, writes
+    assert writes[0].startswith(b'HTTP/1.') and \
+        writes[0].endswith(b'\r\n\r\n'), writes[0]
+    assert writes[1:] == [piece] * 3
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run micro-benchmarks of microdot internals')
+    parser.add_argument('cases', nargs='*', metavar='case',
+                        help='cases to run (default: all of them)')
+    parser.add_argument('--check', action='store_true',
+                        help='run the checks instead of the benchmarks')
+    parser.add_argument('-n', '--number', type=int,
+                        help='calls per timing (default: enough calls to '
+                             'take 0.2 s)')
+    parser.add_argument('-o', '--output', help='write the results to a file')
+    args = parser.parse_args()
+    if args.check:
+        for name in args.cases or checks:
+            checks[name]()
+            print('{:32} ok'.format(name), file=sys.stderr)
+        return
+    results = {}
+    for name in args.cases or cases:
+        timer = timeit.Timer(cases[name])
+        number = args.number or timer.autorange()[0]
+        best = min(timer.repeat(repeat=5, number=number))
+        results[name] = round(best / number * 1e9, 1)
+        print('{:32} {:10.1f} ns'.format(name, results[name]),
+              file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'ns_per_call': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,7 @@ servers for MicroPython and standard Python.
 """
 import asyncio
 import io
+import os
 import re
 import time
 
@@ -15,6 +16,11 @@ try:
 except ImportError:
     import json
 
+try:
+    import zlib
+except ImportError:  # pragma: no cover
+    zlib = None
+
 try:
     from inspect import iscoroutinefunction, iscoroutine
     from functools import partial
@@ -60,29 +66,98 @@ MUTED_SOCKET_ERRORS = [
     128,  # Operation on closed socket
 ]
 
+# Day and month names used in HTTP dates
+HTTP_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+HTTP_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep',
+               'Oct', 'Nov', 'Dec')
+
+
+# Value of each hexadecimal digit, by character code, with 0xff for the
+# characters that are not hex digits
+_HEX_VALUES = bytearray(b'\xff' * 256)
+for _c in b'0123456789abcdefABCDEF':
+    _HEX_VALUES[_c] = int(chr(_c), 16)
+
+# Characters that urlencode() escapes, with their escapes. '%' must be the
+# first, so that the escapes added for the others are not escaped again.
+_URL_ESCAPES = (('%', '%25'), ('+', '%2B'), (' ', '+'), ('?', '%3F'),
+                ('#', '%23'), ('&', '%26'), ('=', '%3D'))
+_URL_ESCAPES_BYTES = tuple((c.encode(), e.encode()) for c, e in _URL_ESCAPES)
+
+
+def _decode_utf8(data):
+    # invalid UTF-8 is replaced with U+FFFD instead of raising an error
+    try:
+        return str(data, 'utf-8', 'replace')
+    except UnicodeError:
+        pass
+    # MicroPython ignores the errors argument, so each byte that does not
+    # start a valid character is replaced here
+    text = ''
+    start = i = 0
+    while i < len(data):
+        if data[i] < 0x80:
+            i += 1
+            continue
+        for size in (2, 3, 4):
+            try:
+                str(data[i:i + size], 'utf-8')
+                break
+            except UnicodeError:
+                pass
+        else:
+            text += str(data[start:i], 'utf-8') + '\ufffd'
+            i += 1
+            start = i
+            continue
+        i += size
+    return text + str(data[start:], 'utf-8')
+
 
 def urldecode(s):
     if isinstance(s, str):
+        if '%' not in s:
+            return s.replace('+', ' ')
         s = s.encode()
-    s = s.replace(b'+', b' ')
-    parts = s.split(b'%')
-    if len(parts) == 1:
-        return s.decode()
-    result = [parts[0]]
-    for item in parts[1:]:
-        if item == b'':
-            result.append(b'%')
-        else:
-            code = item[:2]
-            result.append(bytes([int(code, 16)]))
-            result.append(item[2:])
-    return b''.join(result).decode()
+    elif b'%' not in s:
+        return _decode_utf8(s.replace(b'+', b' '))
+    parts = s.replace(b'+', b' ').split(b'%')
+    result = bytearray(parts[0])
+    hex_values = _HEX_VALUES
+    for i in range(1, len(parts)):
+        item = parts[i]
+        if len(item) > 1:
+            high = hex_values[item[0]]
+            low = hex_values[item[1]]
+            if high | low < 16:
+                result.append(high << 4 | low)
+                result += item[2:]
+                continue
+        # not a valid escape, so the '%' is kept as it is
+        result += b'%'
+        result += item
+    return _decode_utf8(result)
 
 
 def urlencode(s):
-    return s.replace('+', '%2B').replace(' ', '+').replace(
-        '%', '%25').replace('?', '%3F').replace('#', '%23').replace(
-            '&', '%26').replace('=', '%3D')
+    escapes = _URL_ESCAPES if isinstance(s, str) else _URL_ESCAPES_BYTES
+    for c, escape in escapes:
+        if c in s:
+            s = s.replace(c, escape)
+    return s
+
+
+# marks a missing dictionary key, where None can be a value
+_missing = object()
+
+
+def _json_loads(data):
+    # the bytes are decoded without a copy to str, unless the json module
+    # only accepts str
+    try:
+        return json.loads(data)
+    except TypeError:  # pragma: no cover
+        return json.loads(data.decode())
 
 
 class NoCaseDict(dict):
@@ -104,33 +179,71 @@ class NoCaseDict(dict):
         >>> del d['cOnTeNt-TyPe']
         >>> print(d)
         {}
+
+    Keys are stored with the case they were first set with, and a lookup
+    with that same case is answered without lowercasing the key. Giving all
+    the keys in ``initial_dict`` is faster than setting them one by one.
     """
+    __slots__ = ('keymap',)
+
     def __init__(self, initial_dict=None):
-        super().__init__(initial_dict or {})
-        self.keymap = {k.lower(): k for k in self.keys() if k.lower() != k}
+        initial_dict = initial_dict or {}
+        #: The keys as they are stored, by their lowercase version.
+        self.keymap = {k.lower(): k for k in initial_dict}
+        if len(self.keymap) == len(initial_dict):
+            super().__init__(initial_dict)
+        else:
+            # some keys only differ in case, they are merged into one
+            super().__init__()
+            self.keymap = {}
+            for key, value in initial_dict.items():
+                self[key] = value
 
     def __setitem__(self, key, value):
         kl = key.lower()
-        key = self.keymap.get(kl, key)
-        if kl != key:
+        stored = self.keymap.get(kl)
+        if stored is None:
             self.keymap[kl] = key
+        else:
+            key = stored
         super().__setitem__(key, value)
 
     def __getitem__(self, key):
-        kl = key.lower()
-        return super().__getitem__(self.keymap.get(kl, kl))
+        value = super().get(key, _missing)
+        if value is _missing:
+            value = super().__getitem__(self.keymap.get(key.lower(), key))
+        return value
 
     def __delitem__(self, key):
-        kl = key.lower()
-        super().__delitem__(self.keymap.get(kl, kl))
+        super().__delitem__(self.keymap.pop(key.lower(), key))
 
     def __contains__(self, key):
-        kl = key.lower()
-        return self.keymap.get(kl, kl) in self.keys()
+        return key.lower() in self.keymap
 
     def get(self, key, default=None):
-        kl = key.lower()
-        return super().get(self.keymap.get(kl, kl), default)
+        value = super().get(key, _missing)
+        if value is _missing:
+            key = self.keymap.get(key.lower())
+            value = default if key is None else super().get(key, default)
+        return value
+
+    def pop(self, key, *args):
+        return super().pop(self.keymap.pop(key.lower(), key), *args)
+
+    def popitem(self):
+        key, value = super().popitem()
+        del self.keymap[key.lower()]
+        return key, value
+
+    def setdefault(self, key, default=None):
+        value = self.get(key, _missing)
+        if value is _missing:
+            self[key] = value = default
+        return value
+
+    def clear(self):
+        super().clear()
+        self.keymap.clear()
 
     def update(self, other_dict):
         for key, value in other_dict.items():
@@ -269,6 +382,9 @@ class AsyncBytesIO:
     async def read(self, n=-1):
         return self.stream.read(n)
 
+    async def readinto(self, buf):
+        return self.stream.readinto(buf)
+
     async def readline(self):  # pragma: no cover
         return self.stream.readline()
 
@@ -276,7 +392,13 @@ class AsyncBytesIO:
         return self.stream.read(n)
 
     async def readuntil(self, separator=b'\n'):  # pragma: no cover
-        return self.stream.readuntil(separator=separator)
+        # BytesIO has no readuntil, so the separator is found in the
+        # buffer instead
+        start = self.stream.tell()
+        end = self.stream.getvalue().find(separator, start)
+        if end < 0:
+            raise asyncio.IncompleteReadError(self.stream.read(), None)
+        return self.stream.read(end - start + len(separator))
 
     async def awrite(self, data):  # pragma: no cover
         return self.stream.write(data)
@@ -285,6 +407,258 @@ class AsyncBytesIO:
         pass
 
 
+class BodyStream:
+    """An async stream that reads a request body from the connection.
+
+    :param stream: The connection stream the body is read from.
+    :param length: The length of the body, from the ``Content-Length``
+                   header. If ``None``, the body is decoded from the
+                   ``chunked`` transfer encoding.
+    :param max_length: The largest ``chunked`` body that is accepted. Reads
+                       that go over it raise a ``413`` error.
+
+    Invalid ``chunked`` framing raises a ``400`` error. The error raised is
+    also kept in ``error``, so that it is sent even if the application
+    catches it.
+
+    Reads never go past the end of the body, so that the connection can be
+    used for the next request once ``eof`` is set.
+    """
+    def __init__(self, stream, length=None, max_length=None):
+        self.stream = stream
+        self.chunked = length is None
+        self.remaining = length or 0
+        self.eof = not self.chunked and not length
+        self.max_length = max_length
+        self.length = 0  # size of the chunks received so far
+        self.error = None
+
+    def _fail(self, status_code, reason):
+        self.error = HTTPException(status_code, reason)
+        raise self.error
+
+    async def _next_chunk(self):
+        line = await Request._safe_readline(self.stream)
+        if not line:
+            raise EOFError('incomplete body')
+        size = line.split(b';', 1)[0].strip()
+        # only plain hex digits, a sign would allow a negative size
+        if not size or any(_HEX_VALUES[c] > 15 for c in size):
+            self._fail(400, 'Invalid chunk size')
+        self.remaining = int(size, 16)
+        self.length += self.remaining
+        if self.max_length is not None and self.length > self.max_length:
+            self._fail(413, 'Payload too large')
+        if self.remaining == 0:
+            # skip the trailer section
+            while (await Request._safe_readline(self.stream)).strip():
+                pass
+            self.eof = True
+
+    async def read(self, n=-1):
+        if n < 0:
+            data = b''
+            while not self.eof:
+                data += await self.read(Request.max_readline)
+            return data
+        if self.eof or n == 0:
+            return b''
+        if self.remaining == 0:
+            await self._next_chunk()
+            if self.eof:
+                return b''
+        data = await self.stream.read(min(n, self.remaining))
+        await self._consumed(len(data))
+        return data
+
+    async def readinto(self, buf):
+        """Read up to ``len(buf)`` bytes of the body into ``buf``, without
+        allocating a new bytes object when the connection stream supports
+        ``readinto``. Returns the number of bytes read, which is 0 at the end
+        of the body."""
+        if self.eof or len(buf) == 0:
+            return 0
+        if self.remaining == 0:
+            await self._next_chunk()
+            if self.eof:
+                return 0
+        mv = memoryview(buf)
+        if len(mv) > self.remaining:
+            mv = mv[:self.remaining]
+        if hasattr(self.stream, 'readinto'):
+            n = await self.stream.readinto(mv) or 0
+        else:
+            data = await self.stream.read(len(mv))
+            n = len(data)
+            mv[:n] = data
+        await self._consumed(n)
+        return n
+
+    async def _consumed(self, n):
+        if not n:
+            raise EOFError('incomplete body')
+        self.remaining -= n
+        if self.remaining == 0:
+            if self.chunked:
+                if await self.stream.readexactly(2) != b'\r\n':
+                    self._fail(400, 'Invalid chunk')
+            else:
+                self.eof = True
+
+    async def readexactly(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = await self.read(n - len(data))
+            if not chunk:
+                raise EOFError('incomplete body')
+            data += chunk
+        return data
+
+
+# Classes of the bytes that matter when looking for the end of a JSON value
+_JSON_OPEN = 1
+_JSON_CLOSE = 2
+_JSON_COMMA = 3
+_JSON_QUOTE = 4
+_JSON_SPACE = 5
+_JSON_CLASSES = bytearray(256)
+for _c, _class in ((b'[{', _JSON_OPEN), (b']}', _JSON_CLOSE),
+                   (b',', _JSON_COMMA), (b'"', _JSON_QUOTE),
+                   (b' \t\r\n', _JSON_SPACE)):
+    for _i in _c:
+        _JSON_CLASSES[_i] = _class
+
+
+class JSONArrayReader:
+    """An async iterator that decodes the items of a JSON array one at a
+    time, as the array is read from a stream.
+
+    :param stream: The stream the array is read from.
+    :param chunk_size: The number of bytes read from the stream at a time.
+    :param max_item_size: The largest item that is accepted, in bytes. The
+                          default is ``Request.max_body_length``.
+
+    Only the item being decoded is held in memory, so arrays much larger
+    than ``Request.max_body_length`` can be processed. Invalid JSON raises
+    ``ValueError``.
+
+    Example::
+
+        @app.post('/trajectory')
+        async def trajectory(request):
+            async for point in request.json_items():
+                await move_to(point)
+    """
+    def __init__(self, stream, chunk_size=512, max_item_size=None):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_item_size = max_item_size or Request.max_body_length
+        self.data = b''
+        self.pos = 0  # start of the next item
+        self.scan = 0  # where the search for the end of the item resumes
+        self.depth = 0  # nesting level at the scan position
+        self.started = False
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.started:
+            if await self._next_byte() != ord('['):
+                raise ValueError('not a JSON array')
+            self.pos += 1
+            self.started = True
+            if await self._next_byte() == ord(']'):
+                await self._finish()
+        if self.done:
+            raise StopAsyncIteration
+        await self._next_byte()
+        self.scan = self.pos
+        self.depth = 0
+        while True:
+            end = self._find_end()
+            if end >= 0:
+                break
+            await self._fill()
+        item = _json_loads(self.data[self.pos:end])
+        c = self.data[end]
+        self.pos = end + 1
+        if c == ord(']'):
+            await self._finish()
+        elif c != ord(','):
+            raise ValueError('invalid JSON array')
+        return item
+
+    async def _fill(self):
+        if len(self.data) - self.pos > self.max_item_size:
+            raise ValueError('JSON item too large')
+        chunk = await self.stream.read(self.chunk_size)
+        if not chunk:
+            raise ValueError('incomplete JSON array')
+        self.scan -= self.pos
+        self.data = self.data[self.pos:] + chunk
+        self.pos = 0
+
+    async def _next_byte(self):
+        # skip whitespace and return the next byte
+        while True:
+            while self.pos < len(self.data):
+                c = self.data[self.pos]
+                if _JSON_CLASSES[c] != _JSON_SPACE:
+                    return c
+                self.pos += 1
+            await self._fill()
+
+    async def _finish(self):
+        # the array is complete, read the rest of the body so that the
+        # connection can be kept open
+        self.done = True
+        self.data = b''
+        self.pos = self.scan = 0
+        while await self.stream.read(self.chunk_size):
+            pass
+
+    def _find_end(self):
+        # find the comma or bracket that ends the current item, or return
+        # -1 if it hasn't been read yet
+        data = self.data
+        classes = _JSON_CLASSES
+        depth = self.depth
+        i = self.scan
+        n = len(data)
+        end = -1
+        while i < n:
+            c = classes[data[i]]
+            if c == _JSON_QUOTE:
+                # jump to the closing quote, skipping escaped ones
+                j = data.find(b'"', i + 1)
+                while j > 0:
+                    k = j - 1
+                    while data[k] == 92:  # backslash
+                        k -= 1
+                    if (j - k) % 2:
+                        break
+                    j = data.find(b'"', j + 1)
+                if j < 0:
+                    break
+                i = j
+            elif c == _JSON_OPEN:
+                depth += 1
+            elif c == _JSON_CLOSE:
+                if depth == 0:
+                    end = i
+                    break
+                depth -= 1
+            elif c == _JSON_COMMA and depth == 0:
+                end = i
+                break
+            i += 1
+        self.scan = i
+        self.depth = depth
+        return end
+
+
 class Request:
     """An HTTP request."""
     #: Specify the maximum payload size that is accepted. Requests with larger
@@ -316,6 +690,14 @@ class Request:
     #:    Request.max_readline = 16 * 1024  # 16KB lines allowed
     max_readline = 2 * 1024
 
+    #: Specify the maximum size of the request line and headers together.
+    #: Requests with larger heads are rejected with a 431 status code.
+    #:
+    #: Example::
+    #:
+    #:    Request.max_head_length = 16 * 1024  # 16KB heads allowed
+    max_head_length = 8 * 1024
+
     class G:
         pass
 
@@ -340,35 +722,27 @@ class Request:
         self.path = url
         #: The query string portion of the URL.
         self.query_string = None
-        #: The parsed query string, as a
-        #: :class:`MultiDict <microdot.MultiDict>` object.
-        self.args = {}
         #: A dictionary with the headers included in the request.
         self.headers = headers
-        #: A dictionary with the cookies included in the request.
-        self.cookies = {}
         #: The parsed ``Content-Length`` header.
         self.content_length = 0
         #: The parsed ``Content-Type`` header.
         self.content_type = None
-        #: A general purpose container for applications to store data during
-        #: the life of the request.
-        self.g = Request.G()
 
         self.http_version = http_version
         if '?' in self.path:
             self.path, self.query_string = self.path.split('?', 1)
-            self.args = self._parse_urlencoded(self.query_string)
 
-        if 'Content-Length' in self.headers:
-            self.content_length = int(self.headers['Content-Length'])
-        if 'Content-Type' in self.headers:
-            self.content_type = self.headers['Content-Type']
-        if 'Cookie' in self.headers:
-            for cookie in self.headers['Cookie'].split(';'):
-                name, value = cookie.strip().split('=', 1)
-                self.cookies[name] = value
+        content_length = self.headers.get('Content-Length')
+        if content_length is not None:
+            self.content_length = int(content_length)
+        self.content_type = self.headers.get('Content-Type')
 
+        # the query string arguments, cookies and g are only created when
+        # the application uses them
+        self._args = None
+        self._cookies = None
+        self._g = None
         self._body = body
         self.body_used = False
         self._stream = stream
@@ -376,7 +750,39 @@ class Request:
         self._json = None
         self._form = None
         self._files = None
-        self.after_request_handlers = []
+
+    #: The request specific after request handlers. A list is only created
+    #: when the first handler is registered with :meth:`after_request`.
+    after_request_handlers = ()
+
+    @property
+    def args(self):
+        """The parsed query string, as a
+        :class:`MultiDict <microdot.MultiDict>` object, or an empty
+        dictionary if the URL does not have a query string."""
+        if self._args is None:
+            self._args = self._parse_urlencoded(self.query_string) \
+                if self.query_string else {}
+        return self._args
+
+    @property
+    def cookies(self):
+        """A dictionary with the cookies included in the request."""
+        if self._cookies is None:
+            self._cookies = {}
+            for cookie in self.headers.get('Cookie', '').split(';'):
+                name, sep, value = cookie.strip().partition('=')
+                if sep:
+                    self._cookies[name] = value
+        return self._cookies
+
+    @property
+    def g(self):
+        """A general purpose container for applications to store data during
+        the life of the request."""
+        if self._g is None:
+            self._g = Request.G()
+        return self._g
 
     @staticmethod
     async def create(app, client_reader, client_writer, client_addr):
@@ -392,35 +798,42 @@ class Request:
         This method is a coroutine. It returns a newly created ``Request``
         object.
         """
-        # request line
-        line = (await Request._safe_readline(client_reader)).strip().decode()
+        # request line and headers, parsed from a single buffer
+        lines = (await Request._read_head(client_reader)).decode().split('\n')
+        if len(lines[0]) > Request.max_readline:
+            raise ValueError('line too long')
+        line = lines[0].strip()
         if not line:  # pragma: no cover
             return None
         method, url, http_version = line.split()
         http_version = http_version.split('/', 1)[1]
 
         # headers
-        headers = NoCaseDict()
-        content_length = 0
-        while True:
-            line = (await Request._safe_readline(
-                client_reader)).strip().decode()
-            if line == '':
+        fields = {}
+        for line in lines[1:]:
+            if len(line) > Request.max_readline:
+                raise ValueError('line too long')
+            if len(line) <= 1:
+                # the blank line that ends the headers
                 break
             header, value = line.split(':', 1)
-            value = value.strip()
-            headers[header] = value
-            if header.lower() == 'content-length':
-                content_length = int(value)
+            fields[header] = value.strip()
+        headers = NoCaseDict(fields)
+        content_length = int(headers.get('Content-Length', 0))
+        chunked = headers.get('Transfer-Encoding', '').lower().endswith(
+            'chunked')
 
         # body
         body = b''
-        if content_length and content_length <= Request.max_body_length:
+        stream = None
+        if chunked:
+            # the length of the body is not known, so it is always streamed
+            stream = BodyStream(client_reader,
+                                max_length=Request.max_content_length)
+        elif content_length and content_length <= Request.max_body_length:
             body = await client_reader.readexactly(content_length)
-            stream = None
-        else:
-            body = b''
-            stream = client_reader
+        elif content_length:
+            stream = BodyStream(client_reader, content_length)
 
         return Request(app, client_addr, method, url, http_version, headers,
                        body=body, stream=stream,
@@ -448,7 +861,9 @@ class Request:
 
     @property
     def stream(self):
-        """The body of the request, as a bytes stream."""
+        """The body of the request, as a bytes stream. Bodies sent with the
+        ``chunked`` transfer encoding are decoded as they are read, and are
+        only available through this stream."""
         if self._stream is None:
             self._stream = AsyncBytesIO(self._body)
         return self._stream
@@ -456,16 +871,35 @@ class Request:
     @property
     def json(self):
         """The parsed JSON body, or ``None`` if the request does not have a
-        JSON body."""
+        JSON body.
+
+        Bodies larger than ``max_body_length`` are not held in memory. If
+        they are JSON arrays, their items can be decoded one at a time with
+        :meth:`json_items`.
+        """
         if self._json is None:
             if self.content_type is None:
                 return None
             mime_type = self.content_type.split(';')[0]
             if mime_type != 'application/json':
                 return None
-            self._json = json.loads(self.body.decode())
+            self._json = _json_loads(self.body)
         return self._json
 
+    def json_items(self, chunk_size=512, max_item_size=None):
+        """Return a :class:`JSONArrayReader <microdot.JSONArrayReader>` that
+        decodes the items of a JSON array body one at a time, as they are
+        read from :attr:`stream`, or ``None`` if the request does not have a
+        JSON body.
+
+        :param chunk_size: The number of bytes read at a time.
+        :param max_item_size: The largest item that is accepted, in bytes.
+        """
+        if self.content_type is None or \
+                self.content_type.split(';')[0] != 'application/json':
+            return None
+        return JSONArrayReader(self.stream, chunk_size, max_item_size)
+
     @property
     def form(self):
         """The parsed form submission body, as a
@@ -519,9 +953,37 @@ class Request:
         Note that the function is not called if the request handler raises an
         exception and an error response is returned instead.
         """
+        if not self.after_request_handlers:
+            self.after_request_handlers = []
         self.after_request_handlers.append(f)
         return f
 
+    @staticmethod
+    async def _read_head(stream):
+        # read the request line and the headers, up to and including the
+        # blank line that ends them
+        if hasattr(stream, 'readuntil'):
+            try:
+                head = await stream.readuntil(b'\r\n\r\n')
+            except asyncio.IncompleteReadError as exc:
+                # the connection was closed
+                head = exc.partial
+            except asyncio.LimitOverrunError:
+                head = None
+            if head is None or len(head) > Request.max_head_length:
+                raise HTTPException(431, 'Request header fields too large')
+            return head
+        # MicroPython streams do not have readuntil, so the head is read
+        # line by line
+        line = await Request._safe_readline(stream)
+        head = line
+        while line.strip():
+            line = await Request._safe_readline(stream)
+            head += line
+            if len(head) > Request.max_head_length:
+                raise HTTPException(431, 'Request header fields too large')
+        return head
+
     @staticmethod
     async def _safe_readline(stream):
         line = (await stream.readline())
@@ -542,8 +1004,8 @@ class Response:
                         default is 200.
     :param headers: A dictionary of headers to include in the response.
     :param reason: A custom reason phrase to add after the status code. The
-                   default is "OK" for responses with a 200 status code and
-                   "N/A" for any other status codes.
+                   default is the standard phrase for the status code from
+                   :attr:`reason_phrases`, or "N/A" for unknown codes.
     """
     types_map = {
         'css': 'text/css',
@@ -557,6 +1019,57 @@ class Response:
         'svg': 'image/svg+xml',
     }
 
+    #: The reason phrases used in the status line of responses that do not
+    #: have a custom reason.
+    reason_phrases = {
+        100: 'Continue',
+        101: 'Switching Protocols',
+        200: 'OK',
+        201: 'Created',
+        202: 'Accepted',
+        204: 'No Content',
+        206: 'Partial Content',
+        301: 'Moved Permanently',
+        302: 'Found',
+        303: 'See Other',
+        304: 'Not Modified',
+        307: 'Temporary Redirect',
+        308: 'Permanent Redirect',
+        400: 'Bad Request',
+        401: 'Unauthorized',
+        403: 'Forbidden',
+        404: 'Not Found',
+        405: 'Method Not Allowed',
+        408: 'Request Timeout',
+        409: 'Conflict',
+        411: 'Length Required',
+        412: 'Precondition Failed',
+        413: 'Content Too Large',
+        414: 'URI Too Long',
+        415: 'Unsupported Media Type',
+        416: 'Range Not Satisfiable',
+        429: 'Too Many Requests',
+        431: 'Request Header Fields Too Large',
+        500: 'Internal Server Error',
+        501: 'Not Implemented',
+        502: 'Bad Gateway',
+        503: 'Service Unavailable',
+        504: 'Gateway Timeout',
+    }
+
+    #: Encoded status lines, by HTTP version and status code. They are
+    #: added as they are first used.
+    status_lines = {}
+
+    #: Encoded header lines of headers whose values do not change from one
+    #: response to the next, by header name and value. Headers that are not
+    #: here are formatted for each response. See :meth:`cache_header`.
+    header_lines = {}
+
+    #: The size of the buffer used to read file bodies when they cannot be
+    #: sent with the operating system's ``sendfile`` support. This can also be
+    #: set per response with the ``buffer_size`` argument of
+    #: :meth:`send_file`.
     send_file_buffer_size = 1024
 
     #: The content type to use for responses that do not explicitly define a
@@ -567,10 +1080,38 @@ class Response:
     #: of ``None`` means that no ``Cache-Control`` header is added.
     default_send_file_max_age = None
 
+    #: Whether files sent by :meth:`send_file` with ``gzip=True`` that do
+    #: not have a ``.gz`` version are compressed as they are sent, if their
+    #: content type is in :attr:`compressible_types`. This needs a ``zlib``
+    #: module with ``compressobj``, which MicroPython does not have.
+    compress_text_files = False
+
+    #: The content types, or content type prefixes, of files that are
+    #: compressed as they are sent when :attr:`compress_text_files` is set.
+    compressible_types = ('text/', 'application/javascript',
+                          'application/json', 'image/svg+xml')
+
+    #: Cached ``(size, mtime, etag, last_modified)`` validators of the files
+    #: sent by :meth:`send_file`, by file name. They are recalculated when
+    #: the size or modification time of a file changes.
+    validator_cache = {}
+
+    #: The maximum number of files in :attr:`validator_cache`.
+    validator_cache_size = 32
+
     #: Special response used to signal that a response does not need to be
     #: written to the client. Used to exit WebSocket connections cleanly.
     already_handled = None
 
+    #: The HTTP version used in the status line of the response. Keep-alive
+    #: connections are answered with ``'1.1'``.
+    http_version = '1.0'
+
+    #: Bodies, or first pieces of a body, of up to this many bytes are sent
+    #: in a single write together with the status line and headers, instead
+    #: of in separate TCP segments.
+    coalesce_body_size = 1024
+
     def __init__(self, body='', status_code=200, headers=None, reason=None):
         if body is None and status_code == 200:
             body = ''
@@ -587,6 +1128,21 @@ class Response:
             # this applies to bytes, file-like objects or generators
             self.body = body
         self.is_head = False
+        #: The ``(offset, count)`` portion of a file body that is sent, or
+        #: ``None`` to send the whole file.
+        self.file_range = None
+        #: The name of a file body that can be sent gzip compressed, or
+        #: ``None``.
+        self.gzip_file = None
+        #: The modification time of :attr:`gzip_file`.
+        self.gzip_mtime = 0
+        #: The name of a file that is opened as the body when the response
+        #: is sent, or ``None``. Responses that end up without a body, such
+        #: as ``304`` responses, never open the file.
+        self.file_name = None
+        #: Whether the ``Cache-Control`` header of a file response uses the
+        #: default max age, which the application can override by URL.
+        self.default_max_age = False
 
     def set_cookie(self, cookie, value, path=None, domain=None, expires=None,
                    max_age=None, secure=False, http_only=False,
@@ -642,45 +1198,110 @@ class Response:
         if isinstance(self.body, bytes) and \
                 'Content-Length' not in self.headers:
             self.headers['Content-Length'] = str(len(self.body))
+        if self.http_version != '1.0' and \
+                'Content-Length' not in self.headers and \
+                'Transfer-Encoding' not in self.headers:
+            # the length of the body is unknown, so it is sent in chunks
+            self.headers['Transfer-Encoding'] = 'chunked'
         if 'Content-Type' not in self.headers:
             self.headers['Content-Type'] = self.default_content_type
             if 'charset=' not in self.headers['Content-Type']:
                 self.headers['Content-Type'] += '; charset=UTF-8'
 
+    @classmethod
+    def cache_header(cls, header, value):
+        """Pre-encode a header line that many responses include, so that it
+        does not need to be formatted for each of them.
+
+        :param header: The header name, as it is set in the responses.
+        :param value: The header value.
+        """
+        cls.header_lines.setdefault(header, {})[value] = \
+            '{header}: {value}\r\n'.format(header=header, value=value).encode()
+
+    def encode_head(self):
+        """Return the status line and headers of the response, encoded as a
+        single bytes object that ends with the blank line."""
+        if self.reason is None:
+            lines = self.status_lines.get(self.http_version)
+            if lines is None:
+                lines = self.status_lines[self.http_version] = {}
+            status_line = lines.get(self.status_code)
+            if status_line is None:
+                status_line = lines[self.status_code] = \
+                    'HTTP/{version} {status_code} {reason}\r\n'.format(
+                        version=self.http_version,
+                        status_code=self.status_code,
+                        reason=self.reason_phrases.get(self.status_code,
+                                                       'N/A')).encode()
+        else:
+            status_line = 'HTTP/{version} {status_code} {reason}\r\n'.format(
+                version=self.http_version, status_code=self.status_code,
+                reason=self.reason).encode()
+        parts = [status_line]
+        header_lines = self.header_lines
+        for header, value in self.headers.items():
+            values = value if isinstance(value, list) else [value]
+            cached = header_lines.get(header)
+            for value in values:
+                line = cached.get(value) if cached else None
+                if line is None:
+                    line = '{header}: {value}\r\n'.format(
+                        header=header, value=value).encode()
+                parts.append(line)
+        parts.append(b'\r\n')
+        return b''.join(parts)
+
     async def write(self, stream):
         self.complete()
 
         try:
-            # status code
-            reason = self.reason if self.reason is not None else \
-                ('OK' if self.status_code == 200 else 'N/A')
-            await stream.awrite('HTTP/1.0 {status_code} {reason}\r\n'.format(
-                status_code=self.status_code, reason=reason).encode())
-
-            # headers
-            for header, value in self.headers.items():
-                values = value if isinstance(value, list) else [value]
-                for value in values:
-                    await stream.awrite('{header}: {value}\r\n'.format(
-                        header=header, value=value).encode())
-            await stream.awrite(b'\r\n')
+            # status line and headers, which are held back to be sent in the
+            # same write as a small body or the first piece of the body
+            head = self.encode_head()
+            if self.is_head:
+                await stream.awrite(head)
+                return
 
             # body
-            if not self.is_head:
-                iter = self.body_iter()
-                async for body in iter:
-                    if isinstance(body, str):  # pragma: no cover
-                        body = body.encode()
-                    try:
-                        await stream.awrite(body)
-                    except OSError as exc:  # pragma: no cover
-                        if exc.errno in MUTED_SOCKET_ERRORS or \
-                                exc.args[0] == 'Connection lost':
-                            if hasattr(iter, 'aclose'):
-                                await iter.aclose()
-                        raise
-                if hasattr(iter, 'aclose'):  # pragma: no branch
-                    await iter.aclose()
+            if self.file_name is not None:
+                self.body = open(self.file_name, 'rb')
+                self.file_name = None
+            chunked = self.headers.get('Transfer-Encoding') == 'chunked'
+            if not chunked and await self.sendfile(stream, head):
+                return
+            iter = self.body_iter()
+            async for body in iter:
+                if isinstance(body, str):  # pragma: no cover
+                    body = body.encode()
+                if chunked:
+                    if not body:
+                        # an empty chunk would end the body
+                        continue
+                    body = '{:x}\r\n'.format(len(body)).encode() + \
+                        body + b'\r\n'
+                if head is not None:
+                    if len(body) <= self.coalesce_body_size:
+                        body = head + body
+                    else:
+                        await stream.awrite(head)
+                    head = None
+                try:
+                    await stream.awrite(body)
+                except OSError as exc:  # pragma: no cover
+                    if exc.errno in MUTED_SOCKET_ERRORS or \
+                            exc.args[0] == 'Connection lost':
+                        if hasattr(iter, 'aclose'):
+                            await iter.aclose()
+                    raise
+            if hasattr(iter, 'aclose'):  # pragma: no branch
+                await iter.aclose()
+            if chunked:
+                await stream.awrite(b'0\r\n\r\n' if head is None
+                                    else head + b'0\r\n\r\n')
+            elif head is not None:
+                # the body was empty
+                await stream.awrite(head)
 
         except OSError as exc:  # pragma: no cover
             if exc.errno in MUTED_SOCKET_ERRORS or \
@@ -689,6 +1310,309 @@ class Response:
             else:
                 raise
 
+    @staticmethod
+    def http_date(t):
+        """Format a time in seconds since the epoch as an HTTP date."""
+        tm = time.gmtime(t)
+        return '{}, {:02d} {} {:04d} {:02d}:{:02d}:{:02d} GMT'.format(
+            HTTP_DAYS[tm[6]], tm[2], HTTP_MONTHS[tm[1] - 1], tm[0], tm[3],
+            tm[4], tm[5])
+
+    @staticmethod
+    def parse_http_date(value):
+        """Parse an HTTP date into a ``(year, month, day, hour, minute,
+        second)`` tuple, which can be compared with another one.
+
+        Returns ``None`` if the date is not valid.
+        """
+        try:
+            _, day, month, year, hms, _ = value.split()
+            hour, minute, second = hms.split(':')
+            return (int(year), HTTP_MONTHS.index(month) + 1, int(day),
+                    int(hour), int(minute), int(second))
+        except ValueError:
+            return None
+
+    @classmethod
+    def file_validators(cls, filename):
+        """Return the size of a file, and the ``ETag`` and ``Last-Modified``
+        header values derived from its size and modification time.
+
+        The validators are ``None`` if the filesystem does not record
+        modification times.
+        """
+        cached = cls._file_info(filename)
+        return cached[0], cached[2], cached[3]
+
+    @classmethod
+    def _file_info(cls, filename):
+        # (size, mtime, etag, last_modified) of a file, from the cache
+        # while its size and modification time are unchanged
+        st = os.stat(filename)
+        size, mtime = st[6], st[8]
+        cached = cls.validator_cache.get(filename)
+        if cached is None or cached[0] != size or cached[1] != mtime:
+            if mtime:
+                cached = (size, mtime, '"{:x}-{:x}"'.format(mtime, size),
+                          cls.http_date(mtime))
+            else:
+                cached = (size, mtime, None, None)
+            if len(cls.validator_cache) >= cls.validator_cache_size:
+                cls.validator_cache.clear()
+            cls.validator_cache[filename] = cached
+        return cached
+
+    @staticmethod
+    def parse_range(range_header, size):
+        """Parse a ``Range`` header for a body of the given size.
+
+        Returns a list of ``(first, last)`` byte positions, an empty list if
+        none of the ranges can be satisfied, or ``None`` if the header is
+        invalid and should be ignored.
+        """
+        unit, _, spec = range_header.partition('=')
+        if unit.strip() != 'bytes':
+            return None
+        ranges = []
+        try:
+            for item in spec.split(','):
+                first, last = item.strip().split('-', 1)
+                if first:
+                    first = int(first)
+                    if first >= size:
+                        if last and first > int(last):
+                            return None
+                        continue
+                    last = min(int(last), size - 1) if last else size - 1
+                    if first > last:
+                        return None
+                    ranges.append((first, last))
+                elif last:
+                    # suffix range with the last bytes of the body
+                    last = int(last)
+                    if last > 0 and size > 0:
+                        ranges.append((max(size - last, 0), size - 1))
+                else:
+                    return None
+        except ValueError:
+            return None
+        return ranges
+
+    def apply_conditional(self, req):
+        """Turn a file response into a ``304`` response without a body if
+        the client's cached copy, given by the ``If-None-Match`` or
+        ``If-Modified-Since`` headers of the request, is still valid.
+
+        :param req: The request object.
+        """
+        if self.status_code != 200 or (self.file_name is None and
+                                       self.gzip_file is None):
+            return
+        if_none_match = req.headers.get('If-None-Match')
+        if if_none_match is not None:
+            etag = self.headers.get('ETag')
+            if etag is None:
+                return
+            etag = etag[2:] if etag.startswith('W/') else etag
+            for tag in if_none_match.split(','):
+                tag = tag.strip()
+                if tag == '*' or (tag[2:] if tag.startswith('W/')
+                                  else tag) == etag:
+                    break
+            else:
+                return
+        else:
+            last_modified = self.headers.get('Last-Modified')
+            if_modified_since = self.parse_http_date(
+                req.headers.get('If-Modified-Since', ''))
+            if last_modified is None or if_modified_since is None or \
+                    self.parse_http_date(last_modified) > if_modified_since:
+                return
+        self.status_code = 304
+        self.file_name = None
+        self.body = b''
+
+    def apply_range(self, req):
+        """Restrict a file response to the byte ranges requested by the
+        client in the ``Range`` header.
+
+        :param req: The request object.
+
+        Only responses that advertise ``Accept-Ranges: bytes`` are modified.
+        If the request has an ``If-Range`` header that does not match the
+        response's ``ETag`` or ``Last-Modified`` headers, the complete file is
+        sent.
+        """
+        range_header = req.headers.get('Range')
+        if not range_header or self.status_code != 200 or \
+                self.headers.get('Accept-Ranges') != 'bytes':
+            return
+        if_range = req.headers.get('If-Range')
+        if if_range and if_range not in (self.headers.get('ETag'),
+                                         self.headers.get('Last-Modified')):
+            return
+        size = int(self.headers['Content-Length'])
+        ranges = self.parse_range(range_header, size)
+        if ranges is None:
+            return
+        if not ranges:
+            self.file_name = None
+            self.body = b''
+            self.status_code = 416
+            self.headers['Content-Range'] = 'bytes */{}'.format(size)
+            self.headers['Content-Length'] = '0'
+            return
+        self.status_code = 206
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            self.file_range = (first, last - first + 1)
+            self.headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                first, last, size)
+            self.headers['Content-Length'] = str(last - first + 1)
+            return
+
+        # multiple ranges are sent as a multipart/byteranges body
+        boundary = 'microdot-{:x}'.format(id(self))
+        part = '\r\n--{}\r\nContent-Type: {}\r\n'.format(
+            boundary, self.headers['Content-Type'])
+        parts = []
+        length = 0
+        for first, last in ranges:
+            head = (part + 'Content-Range: bytes {}-{}/{}\r\n\r\n'.format(
+                first, last, size)).encode()
+            parts.append((head, first, last - first + 1))
+            length += len(head) + last - first + 1
+        tail = '\r\n--{}--\r\n'.format(boundary).encode()
+        self.headers['Content-Type'] = \
+            'multipart/byteranges; boundary=' + boundary
+        self.headers['Content-Length'] = str(length + len(tail))
+        self.body = self._byteranges(self.file_name, parts, tail)
+        self.file_name = None
+
+    @staticmethod
+    def accepts_gzip(accept_encoding):
+        """Check if an ``Accept-Encoding`` header allows gzip compression."""
+        for item in accept_encoding.split(','):
+            coding, _, params = item.partition(';')
+            if coding.strip().lower() in ('gzip', 'x-gzip', '*'):
+                params = params.replace(' ', '')
+                if params.startswith('q='):
+                    try:
+                        return float(params[2:]) > 0
+                    except ValueError:
+                        return False
+                return True
+        return False
+
+    def apply_encoding(self, req):
+        """Send a gzip compressed version of a file response if the client
+        accepts it.
+
+        :param req: The request object.
+
+        The ``.gz`` version of the file is sent if there is one that is not
+        older than the file. If not, the file is compressed as it is sent if
+        :attr:`compress_text_files` is set and its content type is
+        compressible. Only responses from :meth:`send_file` with
+        ``gzip=True`` are modified.
+        """
+        if self.gzip_file is None or self.status_code != 200:
+            return
+        self.headers['Vary'] = 'Accept-Encoding'
+        if not self.accepts_gzip(req.headers.get('Accept-Encoding', '')):
+            return
+        gz_name = self.gzip_file + '.gz'
+        try:
+            size, mtime, etag, last_modified = self._file_info(gz_name)
+        except OSError:
+            mtime = None
+        # a .gz version older than the file is out of date, and ignored
+        if mtime is None or mtime < self.gzip_mtime:
+            content_type = self.headers['Content-Type']
+            if not self.compress_text_files or zlib is None or \
+                    not hasattr(zlib, 'compressobj') or \
+                    not any(content_type.startswith(t)
+                            for t in self.compressible_types):
+                return
+            # compressed on the fly, so the length is not known and parts
+            # of the file cannot be requested
+            self.body = self._gzip_body(self.file_name)
+            self.file_name = None
+            del self.headers['Content-Length']
+            if 'Accept-Ranges' in self.headers:
+                del self.headers['Accept-Ranges']
+            if 'ETag' in self.headers:
+                # the compressed body is not guaranteed to be identical
+                self.headers['ETag'] = 'W/' + \
+                    self.headers['ETag'][:-1] + '-gzip"'
+        else:
+            self.file_name = gz_name
+            self.headers['Content-Length'] = str(size)
+            if etag is not None:
+                self.headers['ETag'] = etag
+                self.headers['Last-Modified'] = last_modified
+        self.headers['Content-Encoding'] = 'gzip'
+
+    def _gzip_body(self, file_name):
+        # a plain generator, so that it works the same way in MicroPython
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        buf = bytearray(self.send_file_buffer_size)
+        mv = memoryview(buf)
+        f = open(file_name, 'rb')
+        try:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                data = compressor.compress(mv[:n])
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            f.close()
+
+    def _byteranges(self, file_name, parts, tail):
+        # a plain generator, so that it works the same way in MicroPython
+        buf = bytearray(self.send_file_buffer_size)
+        mv = memoryview(buf)
+        f = open(file_name, 'rb')
+        try:
+            for head, offset, count in parts:
+                yield head
+                f.seek(offset)
+                while count:
+                    n = f.readinto(mv[:min(count, len(buf))])
+                    if not n:
+                        break
+                    count -= n
+                    yield mv[:n]
+            yield tail
+        finally:
+            f.close()
+
+    async def sendfile(self, stream, head=b''):
+        """Send a file body using the operating system's ``sendfile`` support.
+
+        :param stream: The stream to write to.
+        :param head: The bytes to send before the file, such as the status
+                     line and headers.
+
+        Returns ``False`` without sending anything if the body is not a file
+        or the stream does not support it, as is the case in MicroPython.
+        """
+        transport = getattr(stream, 'transport', None)
+        if transport is None or not hasattr(self.body, 'fileno'):
+            return False
+        offset, count = self.file_range or (0, None)
+        try:
+            stream.write(head)
+            await stream.drain()
+            await asyncio.get_running_loop().sendfile(transport, self.body,
+                                                      offset, count)
+        finally:
+            self.body.close()
+        return True
+
     def body_iter(self):
         if hasattr(self.body, '__anext__'):
             # response body is an async generator
@@ -716,6 +1640,17 @@ class Response:
                 if self.i == self.ITER_UNKNOWN:
                     if hasattr(response.body, 'read'):
                         self.i = self.ITER_FILE_OBJ
+                        self.buf = None
+                        self.remaining = -1
+                        if response.file_range:
+                            offset, self.remaining = response.file_range
+                            response.body.seek(offset)
+                        if hasattr(response.body, 'readinto'):
+                            # read the file into a single buffer that is
+                            # reused for every chunk
+                            self.buf = bytearray(
+                                response.send_file_buffer_size)
+                            self.mv = memoryview(self.buf)
                     elif hasattr(response.body, '__next__'):
                         self.i = self.ITER_SYNC_GEN
                         return next(response.body)
@@ -728,11 +1663,24 @@ class Response:
                     except StopIteration:
                         await self.aclose()
                         raise StopAsyncIteration
-                buf = response.body.read(response.send_file_buffer_size)
-                if iscoroutine(buf):  # pragma: no cover
-                    buf = await buf
-                if len(buf) < response.send_file_buffer_size:
+                size = response.send_file_buffer_size
+                if 0 <= self.remaining < size:
+                    size = self.remaining
+                if self.buf is not None:
+                    n = response.body.readinto(
+                        self.buf if size == len(self.buf)
+                        else self.mv[:size])
+                    if iscoroutine(n):  # pragma: no cover
+                        n = await n
+                    buf = self.mv[:n or 0]
+                else:
+                    buf = response.body.read(size)
+                    if iscoroutine(buf):  # pragma: no cover
+                        buf = await buf
+                if len(buf) < size or len(buf) == self.remaining:
                     self.i = self.ITER_NO_BODY
+                elif self.remaining > 0:
+                    self.remaining -= len(buf)
                 return buf
 
             async def aclose(self):
@@ -758,7 +1706,8 @@ class Response:
     @classmethod
     def send_file(cls, filename, status_code=200, content_type=None,
                   stream=None, max_age=None, compressed=False,
-                  file_extension=''):
+                  file_extension='', buffer_size=None, accept_ranges=False,
+                  gzip=False):
         """Send file contents in a response.
 
         :param filename: The filename of the file.
@@ -785,6 +1734,21 @@ class Response:
                                parameter when opening the file, including the
                                dot. The extension given here is not considered
                                when generating the ``Content-Type`` header.
+        :param buffer_size: The size of the buffer used to read the file, if
+                            it cannot be sent with ``sendfile``. If omitted,
+                            the value of the
+                            :attr:`Response.send_file_buffer_size` attribute
+                            is used.
+        :param accept_ranges: Whether the client can request parts of the
+                              file with the ``Range`` header, which allows
+                              interrupted downloads to be resumed. Ranges are
+                              only supported when the file is opened from
+                              ``filename``.
+        :param gzip: Whether the file can be sent gzip compressed to clients
+                     that accept it. The file with the ``.gz`` extension
+                     added is sent instead if it exists, otherwise see
+                     :attr:`Response.compress_text_files`. The file must be
+                     opened from ``filename`` and not already be compressed.
 
         Security note: The filename is assumed to be trusted. Never pass
         filenames provided by the user without validating and sanitizing them
@@ -801,7 +1765,8 @@ class Response:
                 content_type = 'application/octet-stream'
         headers = {'Content-Type': content_type}
 
-        if max_age is None:
+        default_max_age = max_age is None
+        if default_max_age:
             max_age = cls.default_send_file_max_age
         if max_age is not None:
             headers['Cache-Control'] = 'max-age={}'.format(max_age)
@@ -810,8 +1775,43 @@ class Response:
             headers['Content-Encoding'] = compressed \
                 if isinstance(compressed, str) else 'gzip'
 
-        f = stream or open(filename + file_extension, 'rb')
-        return cls(body=f, status_code=status_code, headers=headers)
+        file_name = gzip_file = None
+        mtime = 0
+        if stream is None:
+            # the size of the file is known, so the response can have a
+            # Content-Length header, and validators for conditional requests
+            file_name = filename + file_extension
+            size, mtime, etag, last_modified = cls._file_info(file_name)
+            headers['Content-Length'] = str(size)
+            if etag is not None:
+                headers['ETag'] = etag
+                headers['Last-Modified'] = last_modified
+            if accept_ranges:
+                headers['Accept-Ranges'] = 'bytes'
+            if gzip and not compressed:
+                gzip_file = file_name
+        res = cls(body=stream or b'', status_code=status_code,
+                  headers=headers)
+        if buffer_size is not None:
+            res.send_file_buffer_size = buffer_size
+        # the file is only opened when the response is sent
+        res.file_name = file_name
+        res.gzip_file = gzip_file
+        res.gzip_mtime = mtime
+        res.default_max_age = default_max_age
+        return res
+
+
+# pre-encode the constant headers of common responses
+for _value in list(Response.types_map.values()) + [
+        'application/octet-stream', 'application/json; charset=UTF-8',
+        'text/plain; charset=UTF-8', 'text/html; charset=UTF-8']:
+    Response.cache_header('Content-Type', _value)
+for _header, _value in (('Transfer-Encoding', 'chunked'),
+                        ('Accept-Ranges', 'bytes'),
+                        ('Content-Encoding', 'gzip'),
+                        ('Vary', 'Accept-Encoding')):
+    Response.cache_header(_header, _value)
 
 
 class URLPattern():
@@ -850,18 +1850,25 @@ class URLPattern():
         cls.segment_patterns[type_name] = '/({})'.format(pattern)
         cls.segment_parsers[type_name] = parser
 
+    #: The arguments returned when a URL pattern without dynamic segments
+    #: matches a path. This dictionary is shared and must not be modified.
+    no_args = {}
+
     def __init__(self, url_pattern):
         self.url_pattern = url_pattern
         self.segments = []
         self.regex = None
+        self.static_path = None
+        self.args = ()
 
     def compile(self):
         """Generate a regular expression for the URL pattern.
 
-        This method is automatically invoked the first time the URL pattern is
-        matched against a path.
+        This method is invoked when the route is registered, or else the first
+        time the URL pattern is matched against a path.
         """
         pattern = ''
+        args = []
         for segment in self.url_pattern.lstrip('/').split('/'):
             if segment and segment[0] == '<':
                 if segment[-1] != '>':
@@ -882,9 +1889,14 @@ class URLPattern():
                     parser = self.segment_parsers.get(type_)
                 self.segments.append({'parser': parser, 'name': name,
                                       'type': type_})
+                args.append((len(args) + 1, name, parser))
             else:
                 pattern += '/' + segment
                 self.segments.append({'parser': None})
+        self.args = tuple(args)
+        if not args:
+            # static patterns are matched with a string comparison
+            self.static_path = pattern
         self.regex = re.compile('^' + pattern + '$')
         return self.regex
 
@@ -893,28 +1905,119 @@ class URLPattern():
 
         Returns a dictionary with the values of all dynamic path segments if a
         matche is found, or ``None`` if the path does not match this pattern.
+        URL patterns without dynamic segments return :attr:`no_args` when
+        they match.
         """
-        args = {}
-        g = (self.regex or self.compile()).match(path)
+        if self.regex is None:
+            self.compile()
+        if self.static_path is not None:
+            return self.no_args if path == self.static_path else None
+        g = self.regex.match(path)
         if not g:
             return
-        i = 1
-        for segment in self.segments:
-            if 'name' not in segment:
-                continue
+        args = {}
+        for i, name, parser in self.args:
             arg = g.group(i)
-            if segment['parser']:
-                arg = self.segment_parsers[segment['type']](arg)
+            if parser:
+                arg = parser(arg)
                 if arg is None:
                     return
-            args[segment['name']] = arg
-            i += 1
+            args[name] = arg
         return args
 
     def __repr__(self):  # pragma: no cover
         return 'URLPattern: {}'.format(self.url_pattern)
 
 
+class Router:
+    """An index of the URL patterns registered in an application.
+
+    Static URL patterns are stored in a dictionary, and URL patterns with
+    dynamic segments in a tree of path segments. This allows the routes
+    that can possibly match a path to be found without testing the path
+    against every URL pattern.
+    """
+    #: URL segment types that always match exactly one path segment. Routes
+    #: that use other segment types are indexed up to the first segment of
+    #: that type, and are then tested against all the remaining paths.
+    single_segment_types = ('string', 'int')
+
+    class Node:
+        def __init__(self):
+            self.children = {}
+            self.param = None
+            self.routes = []
+            self.tails = []
+
+    def __init__(self):
+        self.size = 0
+        self.static = {}
+        self.first = {}
+        self.tree = Router.Node()
+
+    def add(self, url_pattern):
+        """Add the next route in the URL map to the index.
+
+        :param url_pattern: The URL pattern of the route, as a string.
+        """
+        index = self.size
+        self.size += 1
+        if '<' not in url_pattern:
+            # the path that matches a static URL pattern always has exactly
+            # one leading slash
+            path = '/' + url_pattern.lstrip('/')
+            if path not in self.static:
+                self.static[path] = []
+                if not self.find(path):
+                    # no route registered before this one can match the
+                    # path, so this route is tried first and no other
+                    # route needs to be looked up
+                    self.first[path] = index
+            self.static[path].append(index)
+            return
+        node = self.tree
+        for segment in url_pattern.lstrip('/').split('/'):
+            if segment.startswith('<'):
+                segment = segment[1:-1]
+                type_ = segment.rsplit(':', 1)[0] if ':' in segment \
+                    else 'string'
+                if type_ not in self.single_segment_types:
+                    node.tails.append(index)
+                    return
+                if node.param is None:
+                    node.param = Router.Node()
+                node = node.param
+            else:
+                if segment not in node.children:
+                    node.children[segment] = Router.Node()
+                node = node.children[segment]
+        node.routes.append(index)
+
+    def find(self, path):
+        """Return the indexes in the URL map of the routes that may match a
+        path, in the order in which they were registered.
+
+        :param path: The path to look up.
+        """
+        indexes = list(self.static.get(path, ()))
+        self._find(self.tree, path.lstrip('/').split('/'), 0, indexes)
+        if len(indexes) > 1:
+            indexes.sort()
+        return indexes
+
+    def _find(self, node, segments, i, indexes):
+        if node.tails:
+            indexes.extend(node.tails)
+        if i == len(segments):
+            indexes.extend(node.routes)
+            return
+        child = node.children.get(segments[i])
+        if child is not None:
+            self._find(child, segments, i + 1, indexes)
+        if node.param is not None and segments[i]:
+            self._find(node.param, segments, i + 1, indexes)
+
+
 class HTTPException(Exception):
     def __init__(self, status_code, reason=None):
         self.status_code = status_code
@@ -938,8 +2041,17 @@ class Microdot:
         app = Microdot()
     """
 
+    #: The number of seconds a keep-alive connection can remain idle while
+    #: waiting for the next request before it is closed.
+    keep_alive_timeout = 5
+
+    #: The maximum number of requests that are served on a single keep-alive
+    #: connection before it is closed.
+    keep_alive_max_requests = 100
+
     def __init__(self):
         self.url_map = []
+        self.router = Router()
         self.before_request_handlers = []
         self.after_request_handlers = []
         self.after_error_request_handlers = []
@@ -947,7 +2059,9 @@ class Microdot:
         self.shutdown_requested = False
         self.options_handler = self.default_options_handler
         self.debug = False
+        self.keep_alive = False
         self.server = None
+        self.send_file_max_ages = {}
 
     def route(self, url_pattern, methods=None):
         """Decorator that is used to register a function as a request handler
@@ -980,9 +2094,12 @@ class Microdot:
                 return 'Hello, world!'
         """
         def decorated(f):
+            pattern = URLPattern(url_pattern)
+            pattern.compile()
             self.url_map.append(
                 ([m.upper() for m in (methods or ['GET'])],
-                 URLPattern(url_pattern), f, '', None))
+                 pattern, f, '', None))
+            self.router.add(url_pattern)
             return f
         return decorated
 
@@ -1161,9 +2278,14 @@ class Microdot:
                       application. The default is ``False``.
         """
         for methods, pattern, handler, _prefix, _subapp in subapp.url_map:
+            pattern = URLPattern(url_prefix + pattern.url_pattern)
+            pattern.compile()
             self.url_map.append(
-                (methods, URLPattern(url_prefix + pattern.url_pattern),
-                 handler, url_prefix + _prefix, _subapp or subapp))
+                (methods, pattern, handler, url_prefix + _prefix,
+                 _subapp or subapp))
+            self.router.add(pattern.url_pattern)
+        for prefix, max_age in subapp.send_file_max_ages.items():
+            self.send_file_max_ages[url_prefix + prefix] = max_age
         if not local:
             for handler in subapp.before_request_handlers:
                 self.before_request_handlers.append(handler)
@@ -1178,6 +2300,38 @@ class Microdot:
                 self.error_handlers[status_code] = handler
             subapp.error_handlers = {}
 
+    def send_file_max_age(self, url_prefix, max_age):
+        """Set the cache control max age of the files sent by
+        :func:`send_file` for URLs that start with the given prefix.
+
+        :param url_prefix: The URL prefix. When several prefixes match a URL,
+                           the longest one is used.
+        :param max_age: The ``Cache-Control`` header's ``max-age`` value in
+                        seconds, or ``None`` to not add the header.
+
+        This replaces :attr:`Response.default_send_file_max_age` for these
+        URLs, but not a ``max_age`` passed to :func:`send_file`. Example::
+
+            app.send_file_max_age('/static/', 24 * 3600)
+        """
+        self.send_file_max_ages[url_prefix] = max_age
+
+    def apply_max_age(self, req, res):
+        """Set the cache control max age of a file response from the URL
+        prefixes given to :meth:`send_file_max_age`."""
+        match = None
+        for prefix in self.send_file_max_ages:
+            if req.path.startswith(prefix) and \
+                    (match is None or len(prefix) > len(match)):
+                match = prefix
+        if match is None:
+            return
+        max_age = self.send_file_max_ages[match]
+        if max_age is not None:
+            res.headers['Cache-Control'] = 'max-age={}'.format(max_age)
+        elif 'Cache-Control' in res.headers:
+            del res.headers['Cache-Control']
+
     @staticmethod
     def abort(status_code, reason=None):
         """Abort the current request and return an error response with the
@@ -1201,7 +2355,7 @@ class Microdot:
         raise HTTPException(status_code, reason)
 
     async def start_server(self, host='0.0.0.0', port=5000, debug=False,
-                           ssl=None):
+                           ssl=None, keep_alive=False):
         """Start the Microdot web server as a coroutine. This coroutine does
         not normally return, as the server enters an endless listening loop.
         The :func:`shutdown` function provides a method for terminating the
@@ -1220,6 +2374,13 @@ class Microdot:
                       default is ``False``.
         :param ssl: An ``SSLContext`` instance or ``None`` if the server should
                     not use TLS. The default is ``None``.
+        :param keep_alive: If ``True``, connections are kept open after a
+                           response is sent so that clients can issue more
+                           requests, including pipelined ones, on the same
+                           connection. Idle connections are closed after
+                           :attr:`keep_alive_timeout` seconds, and after
+                           :attr:`keep_alive_max_requests` requests. The
+                           default is ``False``.
 
         This method is a coroutine.
 
@@ -1240,6 +2401,7 @@ class Microdot:
             asyncio.run(main())
         """
         self.debug = debug
+        self.keep_alive = keep_alive
 
         async def serve(reader, writer):
             if not hasattr(writer, 'awrite'):  # pragma: no cover
@@ -1282,7 +2444,8 @@ class Microdot:
                 # wait a bit and try again
                 await asyncio.sleep(0.1)
 
-    def run(self, host='0.0.0.0', port=5000, debug=False, ssl=None):
+    def run(self, host='0.0.0.0', port=5000, debug=False, ssl=None,
+            keep_alive=False):
         """Start the web server. This function does not normally return, as
         the server enters an endless listening loop. The :func:`shutdown`
         function provides a method for terminating the server gracefully.
@@ -1300,6 +2463,9 @@ class Microdot:
                       default is ``False``.
         :param ssl: An ``SSLContext`` instance or ``None`` if the server should
                     not use TLS. The default is ``None``.
+        :param keep_alive: If ``True``, connections are kept open after a
+                           response is sent. See :func:`start_server`. The
+                           default is ``False``.
 
         Example::
 
@@ -1314,7 +2480,8 @@ class Microdot:
             app.run(debug=True)
         """
         asyncio.run(self.start_server(host=host, port=port, debug=debug,
-                                      ssl=ssl))  # pragma: no cover
+                                      ssl=ssl, keep_alive=keep_alive)
+                    )  # pragma: no cover
 
     def shutdown(self):
         """Request a server shutdown. The server will then exit its request
@@ -1337,11 +2504,18 @@ class Microdot:
             return self.options_handler(req), '', None
         if method == 'HEAD':
             method = 'GET'
+        router = self.index_routes()
+        i = router.first.get(req.path)
+        if i is not None and method in self.url_map[i][0]:
+            # static route that takes precedence over any others
+            req.url_args = URLPattern.no_args
+            return self.url_map[i][2], self.url_map[i][3], self.url_map[i][4]
         f = 404
         p = ''
         s = None
-        for route_methods, route_pattern, route_handler, url_prefix, subapp \
-                in self.url_map:
+        for i in router.find(req.path):
+            route_methods, route_pattern, route_handler, url_prefix, subapp \
+                = self.url_map[i]
             req.url_args = route_pattern.match(req.path)
             if req.url_args is not None:
                 p = url_prefix
@@ -1353,9 +2527,22 @@ class Microdot:
                     f = 405
         return f, p, s
 
+    def index_routes(self):
+        """Return the routing index for the URL map.
+
+        The routing index is rebuilt if the URL map was modified directly
+        instead of through :func:`route` or :func:`mount`.
+        """
+        if self.router.size != len(self.url_map):
+            self.router = Router()
+            for route in self.url_map:
+                self.router.add(route[1].url_pattern)
+        return self.router
+
     def default_options_handler(self, req):
         allow = []
-        for route_methods, route_pattern, _, _, _ in self.url_map:
+        for i in self.index_routes().find(req.path):
+            route_methods, route_pattern, _, _, _ = self.url_map[i]
             if route_pattern.match(req.path) is not None:
                 allow.extend(route_methods)
         if 'GET' in allow:
@@ -1364,27 +2551,89 @@ class Microdot:
         return {'Allow': ', '.join(allow)}
 
     async def handle_request(self, reader, writer):
-        req = None
-        try:
-            req = await Request.create(self, reader, writer,
-                                       writer.get_extra_info('peername'))
-        except Exception as exc:  # pragma: no cover
-            print_exception(exc)
+        served = 0
+        while True:
+            req = None
+            error = None
+            try:
+                if served:
+                    # wait for the next request on a keep-alive connection
+                    req = await asyncio.wait_for(
+                        Request.create(self, reader, writer,
+                                       writer.get_extra_info('peername')),
+                        self.keep_alive_timeout)
+                    if req is None:
+                        # the client closed the connection
+                        break
+                else:
+                    req = await Request.create(
+                        self, reader, writer,
+                        writer.get_extra_info('peername'))
+            except asyncio.TimeoutError:
+                break
+            except HTTPException as exc:
+                # the request head was rejected, the error is sent before
+                # the connection is closed
+                error = exc
+            except Exception as exc:  # pragma: no cover
+                print_exception(exc)
+                if served:
+                    break
+            served += 1
 
-        res = await self.dispatch_request(req)
-        try:
+            res = await self.dispatch_request(req, error)
+            keep_alive = False
             if res != Response.already_handled:  # pragma: no branch
-                await res.write(writer)
+                if self.keep_alive:
+                    res.http_version = req.http_version \
+                        if req and req.http_version == '1.0' else '1.1'
+                    keep_alive = served < self.keep_alive_max_requests and \
+                        self.can_keep_alive(req, res)
+                    res.headers['Connection'] = \
+                        'keep-alive' if keep_alive else 'close'
+                try:
+                    await res.write(writer)
+                except OSError as exc:  # pragma: no cover
+                    if exc.errno in MUTED_SOCKET_ERRORS:
+                        keep_alive = False
+                    else:
+                        raise
+            if self.debug and req:  # pragma: no cover
+                print('{method} {path} {status_code}'.format(
+                    method=req.method, path=req.path,
+                    status_code=res.status_code))
+            if not keep_alive:
+                break
+        try:
             await writer.aclose()
         except OSError as exc:  # pragma: no cover
             if exc.errno in MUTED_SOCKET_ERRORS:
                 pass
             else:
                 raise
-        if self.debug and req:  # pragma: no cover
-            print('{method} {path} {status_code}'.format(
-                method=req.method, path=req.path,
-                status_code=res.status_code))
+
+    def can_keep_alive(self, req, res):
+        """Determine if the connection can be reused after a response.
+
+        The client must not have asked for the connection to be closed, the
+        request body must have been fully consumed, and the end of the
+        response body must be identifiable by the client, either from its
+        length or from the chunked transfer encoding.
+        """
+        if req is None or (isinstance(req._stream, BodyStream) and
+                           not req._stream.eof):
+            # the request body was not fully read, so it may still be
+            # partially waiting in the connection
+            return False
+        connection = req.headers.get('Connection', '').lower()
+        if req.http_version == '1.0':
+            if 'keep-alive' not in connection:
+                return False
+        elif 'close' in connection:
+            return False
+        res.complete()
+        return res.is_head or 'Content-Length' in res.headers or \
+            res.headers.get('Transfer-Encoding') == 'chunked'
 
     def get_request_handlers(self, req, attr, local_first=True):
         handlers = getattr(self, attr + '_handlers')
@@ -1401,7 +2650,7 @@ class Microdot:
             return await invoke_handler(self.error_handlers[status_code], req)
         return reason or 'N/A', status_code
 
-    async def dispatch_request(self, req):
+    async def dispatch_request(self, req, error=None):
         after_request_handled = False
         if req:
             if req.content_length > req.max_content_length:
@@ -1453,6 +2702,17 @@ class Microdot:
                             # Response object
                             res = Response(res)
 
+                        if res.default_max_age and self.send_file_max_ages:
+                            self.apply_max_age(req, res)
+                        if res.gzip_file is not None:
+                            res.apply_encoding(req)
+                        if req.method in ('GET', 'HEAD'):
+                            if 'If-None-Match' in req.headers or \
+                                    'If-Modified-Since' in req.headers:
+                                res.apply_conditional(req)
+                            if 'Range' in req.headers:
+                                res.apply_range(req)
+
                         # invoke the after request handlers
                         for handler in self.get_request_handlers(
                                 req, 'after_request', True):
@@ -1507,6 +2767,17 @@ class Microdot:
                         # if there is still no response, issue a 500 error
                         res = await self.error_response(
                             req, 500, 'Internal server error')
+                if isinstance(req._stream, BodyStream) and \
+                        req._stream.error is not None:
+                    # a chunked body was invalid or too large, even if the
+                    # handler caught the error
+                    res = await self.error_response(
+                        req, req._stream.error.status_code,
+                        req._stream.error.reason)
+        elif error is not None:
+            # the request was rejected while it was read
+            res = await self.error_response(req, error.status_code,
+                                            error.reason)
         else:
             # if the request could not be parsed, issue a 400 error
             res = await self.error_response(req, 400, 'Bad request')
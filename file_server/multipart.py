@@ -0,0 +1,155 @@
+# Streaming multipart/form-data support for the file server.  The parts
+# of a form are read from the request stream one at a time, and the data
+# of each part can be read in pieces, like a stream, so that uploaded
+# files are written out as they arrive instead of being held in memory.
+
+from microdot import NoCaseDict
+
+
+# Longest header line accepted in a part
+MAX_HEADER_LINE = 1024
+
+# Most header lines accepted in a part
+MAX_HEADERS = 16
+
+
+# Split a header value like 'form-data; name="file"; filename="a.txt"'
+# into the value and a dict of its parameters, with lower case names
+def parse_header_options(value: str):
+    items = value.split(';')
+    options = {}
+    for item in items[1:]:
+        name, sep, option = item.strip().partition('=')
+        if sep:
+            option = option.strip()
+            if len(option) > 1 and option[0] == option[-1] == '"':
+                option = option[1:-1].replace('\\"', '"')
+            options[name.strip().lower()] = option
+    return items[0].strip().lower(), options
+
+# Get the boundary of a multipart Content-Type header, or None if the
+# content type isn't multipart/form-data
+def form_data_boundary(content_type: str):
+    if not content_type:
+        return None
+    mime_type, options = parse_header_options(content_type)
+    boundary = options.get('boundary')
+    if mime_type != 'multipart/form-data' or not boundary or \
+            len(boundary) > 70:
+        return None
+    return boundary.encode()
+
+# Reads the parts of a multipart body from a stream.  next_part() moves to
+# the next part and returns its headers, after which the part's data is
+# read with read() or readinto() until they return nothing.  Errors in the
+# body raise ValueError.
+class MultipartReader:
+    def __init__(self, stream, boundary: bytes, chunk_size: int = 2048):
+        self.stream = stream
+        self.delimiter = b'\r\n--' + boundary
+        self.chunk_size = max(chunk_size, len(self.delimiter) + 4)
+        # The first boundary is at the very start of the body, the CRLF
+        # makes it look like all the others
+        self.data = b'\r\n'
+        self.pos = 0
+        # Anything before the first boundary is skipped like the data of
+        # a part
+        self.in_part = True
+        self.done = False
+
+    # Add the next chunk of the stream to the unread data
+    async def _fill(self) -> None:
+        chunk = await self.stream.read(self.chunk_size)
+        if not chunk:
+            raise ValueError('incomplete multipart body')
+        self.data = self.data[self.pos:] + chunk
+        self.pos = 0
+
+    # Make sure there are at least n bytes of unread data
+    async def _need(self, n: int) -> None:
+        while len(self.data) - self.pos < n:
+            await self._fill()
+
+    # Read a header line, without its CRLF
+    async def _readline(self) -> bytes:
+        while True:
+            i = self.data.find(b'\r\n', self.pos)
+            if i >= 0:
+                line = self.data[self.pos:i]
+                self.pos = i + 2
+                return line
+            if len(self.data) - self.pos > MAX_HEADER_LINE:
+                raise ValueError('multipart header line too long')
+            await self._fill()
+
+    # Number of bytes of the current part that can be taken from the
+    # unread data, up to n.  Returns 0 at the end of the part.
+    async def _available(self, n: int) -> int:
+        while self.in_part:
+            i = self.data.find(self.delimiter, self.pos)
+            if i == self.pos:
+                self.in_part = False
+            elif i >= 0:
+                return min(i - self.pos, n)
+            else:
+                # The end of the data could be the start of the delimiter
+                safe = len(self.data) - self.pos - len(self.delimiter) + 1
+                if safe > 0:
+                    return min(safe, n)
+                await self._fill()
+        return 0
+
+    # Read up to n bytes of the current part
+    async def read(self, n: int = -1) -> bytes:
+        n = await self._available(self.chunk_size if n < 0 else n)
+        data = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return data
+
+    # Read up to len(buf) bytes of the current part into buf, returning
+    # the number of bytes read
+    async def readinto(self, buf) -> int:
+        n = await self._available(len(buf))
+        if n:
+            pos = self.pos
+            memoryview(buf)[:n] = memoryview(self.data)[pos:pos + n]
+            self.pos += n
+        return n
+
+    # Move to the next part and return its headers, or None after the
+    # last part.  The rest of the current part is skipped.
+    async def next_part(self):
+        if self.done:
+            return None
+        while True:
+            n = await self._available(self.chunk_size)
+            if not n:
+                break
+            self.pos += n
+        await self._need(len(self.delimiter) + 2)
+        self.pos += len(self.delimiter)
+        if self.data[self.pos:self.pos + 2] == b'--':
+            # The closing boundary, read the rest of the body so that the
+            # connection can be kept open
+            self.done = True
+            self.data = b''
+            self.pos = 0
+            while await self.stream.read(self.chunk_size):
+                pass
+            return None
+        # The rest of the boundary line can only be whitespace
+        if (await self._readline()).strip():
+            raise ValueError('invalid multipart boundary')
+        headers = NoCaseDict()
+        while True:
+            line = await self._readline()
+            if not line:
+                break
+            if len(headers) == MAX_HEADERS:
+                raise ValueError('too many multipart headers')
+            name, sep, value = line.decode().partition(':')
+            if not sep:
+                raise ValueError('invalid multipart header')
+            headers[name.strip()] = value.strip()
+        self.in_part = True
+        return headers
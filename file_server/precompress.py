@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# Build time helper that writes a gzip compressed `.gz` version next to
+# each text file of a static tree, for `send_file(..., gzip=True)` to send
+# to clients that accept it.  Files that don't get smaller are skipped,
+# and `.gz` files newer than their source are left alone.
+#
+# Usage: python3 precompress.py [--min-size BYTES] <static dir> ...
+
+import argparse
+import gzip
+import os
+
+
+# Extensions of the files that are compressed
+EXTENSIONS = ('.html', '.css', '.js', '.json', '.svg', '.txt')
+
+
+# Compress one file, returning the size of its .gz version, or None if it
+# isn't worth compressing
+def precompress(file_name: str, min_size: int = 256):
+    gz_name = file_name + '.gz'
+    size = os.path.getsize(file_name)
+    if size < min_size:
+        compressed = None
+    elif os.path.exists(gz_name) and \
+            os.path.getmtime(gz_name) >= os.path.getmtime(file_name):
+        return os.path.getsize(gz_name)
+    else:
+        with open(file_name, 'rb') as f:
+            compressed = gzip.compress(f.read(), 9, mtime=0)
+        if len(compressed) >= size:
+            compressed = None
+    if compressed is None:
+        # A stale .gz version must not be sent instead of the file
+        if os.path.exists(gz_name):
+            os.remove(gz_name)
+        return None
+    with open(gz_name, 'wb') as f:
+        f.write(compressed)
+    return len(compressed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write gzip compressed versions of static text files')
+    parser.add_argument('dirs', nargs='+', metavar='dir')
+    parser.add_argument('--min-size', type=int, default=256,
+                        help='smallest file to compress (default 256)')
+    args = parser.parse_args()
+    for top in args.dirs:
+        for root, dirs, files in os.walk(top):
+            for name in sorted(files):
+                if not name.endswith(EXTENSIONS):
+                    continue
+                file_name = os.path.join(root, name)
+                size = os.path.getsize(file_name)
+                gz_size = precompress(file_name, args.min_size)
+                if gz_size is not None:
+                    print('{}: {} -> {} bytes'.format(file_name, size,
+                                                      gz_size))
+
+
+if __name__ == '__main__':
+    main()
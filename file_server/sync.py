@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# Host side tool to sync a local directory tree to a ManT1S file server.
+# The server's manifest of file sizes and SHA-256 hashes is compared with
+# the local tree, and only new or changed files are uploaded, several at
+# a time over keep-alive connections.
+#
+# Usage: python3 sync.py [-j JOBS] <local dir> <host[:port]> [remote dir]
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import sys
+import time
+from urllib.parse import quote
+
+
+# Directories that are never synced
+SKIP_DIRS = ('__pycache__', '.git')
+
+
+# Raised for a response that isn't valid HTTP
+class ProtocolError(Exception):
+    pass
+
+
+# A minimal HTTP/1.1 client connection to a file server that is kept open
+# between requests, and reopened when the server closes it
+class Connection:
+    def __init__(self, host: str, port: int = 80, timeout: float = 30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        # When the first byte of the last response arrived
+        self.first_byte_time = None
+
+    async def open(self) -> None:
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    # Send a request and return (status, headers, body).  The header names
+    # are lower case.  A request on a reused connection that the server
+    # closed in the meantime is retried once on a new connection.
+    async def request(self, method: str, path: str, body: bytes = b'',
+                      headers: dict = None):
+        reused = self.writer is not None
+        try:
+            return await asyncio.wait_for(
+                self._request(method, path, body, headers), self.timeout)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+        return await asyncio.wait_for(
+            self._request(method, path, body, headers), self.timeout)
+
+    async def _request(self, method, path, body, headers):
+        if self.writer is None:
+            await self.open()
+        lines = ['{} {} HTTP/1.1'.format(method, path),
+                 'Host: {}'.format(self.host),
+                 'Content-Length: {}'.format(len(body))]
+        for name, value in (headers or {}).items():
+            lines.append('{}: {}'.format(name, value))
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+        status, response_headers = await self._read_head()
+        if method == 'HEAD' or status in (204, 304):
+            data = b''
+        elif response_headers.get('transfer-encoding') == 'chunked':
+            data = await self._read_chunked()
+        elif 'content-length' in response_headers:
+            data = await self.reader.readexactly(
+                int(response_headers['content-length']))
+        else:
+            data = await self.reader.read()
+            response_headers['connection'] = 'close'
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, response_headers, data
+
+    async def _read_head(self):
+        line = await self.reader.readline()
+        self.first_byte_time = time.monotonic()
+        if not line:
+            raise ConnectionResetError('connection closed by server')
+        try:
+            status = int(line.split(None, 2)[1])
+        except (IndexError, ValueError):
+            raise ProtocolError('invalid status line: {!r}'.format(line))
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode().split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        return status, headers
+
+    async def _read_chunked(self) -> bytes:
+        data = b''
+        while True:
+            size = int((await self.reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                await self.reader.readline()
+                return data
+            data += await self.reader.readexactly(size)
+            await self.reader.readline()
+
+
+# Join a remote directory and a relative path into a quoted URL path
+def url_path(remote_dir: str, path: str = '') -> str:
+    full = '/'.join(p for p in (remote_dir.strip('/'), path) if p)
+    return quote('/' + full)
+
+# Build the manifest of a local directory tree, mapping the path of each
+# file, relative to the directory and separated by '/', to its size and
+# SHA-256 hex digest
+def local_manifest(local_dir: str, exclude=()) -> dict:
+    manifest = {}
+    for root, dirs, files in os.walk(local_dir):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        for name in sorted(files):
+            path = os.path.relpath(os.path.join(root, name), local_dir)
+            path = path.replace(os.sep, '/')
+            if path in exclude:
+                continue
+            with open(os.path.join(root, name), 'rb') as f:
+                data = f.read()
+            manifest[path] = [len(data), hashlib.sha256(data).hexdigest()]
+    return manifest
+
+# Get the manifest of a directory on the server.  A directory that doesn't
+# exist yet has an empty manifest.
+async def fetch_manifest(conn: Connection, remote_dir: str) -> dict:
+    status, headers, body = await conn.request(
+        'GET', url_path(remote_dir) + '?manifest=1')
+    if status == 404:
+        return {}
+    if status != 200:
+        raise ProtocolError('manifest request failed with status {}'.format(
+            status))
+    return json.loads(body)
+
+# The files of a local manifest that are missing or differ on the server
+def changed_files(local: dict, remote: dict) -> list:
+    return [path for path, entry in local.items()
+            if remote.get(path) != entry]
+
+# Upload one file with its digest, so that the server rejects it if it got
+# corrupted on the way.  The file's data is read from the local directory
+# unless it is given.  Returns the number of bytes sent.
+async def upload_file(conn: Connection, local_dir: str, remote_dir: str,
+                      path: str, data: bytes = None) -> int:
+    if data is None:
+        with open(os.path.join(local_dir, *path.split('/')), 'rb') as f:
+            data = f.read()
+    digest = base64.b64encode(hashlib.sha256(data).digest()).decode()
+    status, headers, body = await conn.request(
+        'PUT', url_path(remote_dir, path), data,
+        {'Digest': 'sha-256=' + digest})
+    if status != 200:
+        raise ProtocolError('upload of {} failed with status {}: {}'.format(
+            path, status, body.decode(errors='replace')))
+    return len(data)
+
+# Sync a local directory tree to a server, uploading changed files over up
+# to `jobs` connections at once.  Returns a dict of statistics.
+async def sync(host: str, port: int, local_dir: str, remote_dir: str = '',
+               jobs: int = 4, exclude=(), local: dict = None) -> dict:
+    start = time.monotonic()
+    if local is None:
+        local = local_manifest(local_dir, exclude)
+    conns = [Connection(host, port) for _ in range(max(jobs, 1))]
+    try:
+        remote = await fetch_manifest(conns[0], remote_dir)
+        queue = changed_files(local, remote)
+        uploaded = []
+
+        async def worker(conn):
+            while queue:
+                path = queue.pop(0)
+                await upload_file(conn, local_dir, remote_dir, path)
+                uploaded.append(path)
+
+        await asyncio.gather(*(worker(conn) for conn in conns[:len(queue)]))
+    finally:
+        for conn in conns:
+            conn.close()
+    total = sum(size for size, digest in local.values())
+    sent = sum(local[path][0] for path in uploaded)
+    return {'files': len(local), 'uploaded': uploaded, 'bytes': total,
+            'bytes_sent': sent, 'bytes_saved': total - sent,
+            'seconds': time.monotonic() - start}
+
+# Split a 'host[:port]' argument
+def parse_host(value: str):
+    host, sep, port = value.rpartition(':')
+    if not sep or not port.isdigit():
+        return value, 80
+    return host, int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Upload the changed files of a directory tree to a '
+                    'ManT1S file server')
+    parser.add_argument('local_dir')
+    parser.add_argument('host', help='host[:port] of the file server')
+    parser.add_argument('remote_dir', nargs='?', default='')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='number of uploads at once (default 4)')
+    args = parser.parse_args()
+    host, port = parse_host(args.host)
+    try:
+        stats = asyncio.run(sync(host, port, args.local_dir, args.remote_dir,
+                                 args.jobs))
+    except (OSError, ProtocolError, asyncio.TimeoutError) as exc:
+        print('{}: {}'.format(args.host, exc), file=sys.stderr)
+        sys.exit(1)
+    for path in stats['uploaded']:
+        print('uploaded', path)
+    print('{} of {} files changed, {} bytes sent, {} of {} bytes saved '
+          'in {:.2f} s'.format(len(stats['uploaded']), stats['files'],
+                               stats['bytes_sent'], stats['bytes_saved'],
+                               stats['bytes'], stats['seconds']))
+
+
+if __name__ == '__main__':
+    main()
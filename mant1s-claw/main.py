@@ -66,7 +66,7 @@ async def main():
     print ("Claw web interface listening...")
     # Run all asyncio tasks
     await asyncio.gather(
-        app.start_server(port=80),
+        app.start_server(port=80, keep_alive=True),
         wrist_tilt_servo.run_task(0.025),
         wrist_rotate_servo.run_task(0.025),
         claw_servo.run_task(0.025)
@@ -1,3 +1,6 @@
+from microdot.microdot import Response
+
+
 class CORS:
     """Add CORS headers to HTTP responses.
 
@@ -46,6 +49,17 @@ class CORS:
                             CORS headers manually.
         """
         self.default_options_handler = app.options_handler
+        # pre-encode the CORS headers that are the same for every response
+        for origin in ['*'] + (self.allowed_origins
+                               if isinstance(self.allowed_origins, list)
+                               else []):
+            Response.cache_header('Access-Control-Allow-Origin', origin)
+        Response.cache_header('Vary', 'Origin')
+        if self.allow_credentials:
+            Response.cache_header('Access-Control-Allow-Credentials', 'true')
+        if self.expose_headers:
+            Response.cache_header('Access-Control-Expose-Headers',
+                                  ', '.join(self.expose_headers))
         if handle_cors:
             app.options_handler = self.options_handler
             app.after_request(self.after_request)
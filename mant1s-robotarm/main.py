@@ -7,12 +7,14 @@ from robotarm import shoulder_rotate_servo, shoulder_tilt_servo, \
 
 # Create Microdot web server object
 app = Microdot()
+# Let browsers reuse the UI files for an hour before checking for updates
+app.send_file_max_age('/static/', 3600)
 
 
 # Web control interface
 @app.get('/')
 async def index(req):
-    return send_file('/static/index.html')
+    return send_file('/static/index.html', gzip=True)
 
 # Other static files for web control interface
 @app.get('/static/<path:path>')
@@ -20,7 +22,7 @@ async def static(req, path):
     if '..' in path:
         # directory traversal is not allowed
         return 'Not found', 404
-    return send_file('/static/' + path)
+    return send_file('/static/' + path, gzip=True)
 
 # Get servo state endpoint
 @app.get('/servo')
@@ -63,7 +65,7 @@ async def main():
     print ("Robot arm web interface listening...")
     # Run all asyncio tasks
     await asyncio.gather(
-        app.start_server(port=80),
+        app.start_server(port=80, keep_alive=True),
         shoulder_rotate_servo.run_task(0.025),
         shoulder_tilt_servo.run_task(0.025),
         elbow_servo.run_task(0.025)